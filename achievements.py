@@ -0,0 +1,338 @@
+import threading
+from bisect import bisect_right
+
+import database
+from cache import invalidate_user_box
+from database import get_connection, add_xp
+
+# ------------------ Olay -> tetikleyici eşlemesi ------------------
+# Her yazma işlemi bir olay üretir; yalnızca o olaya abone trigger_type'lar
+# değerlendirilir. Sayaçlar (user_stats) tetikleyicilerle güncel tutulur. xp / level kuralları her değerlendirmede kontrol edilir,
+# çünkü hemen her işlem ve açılan her başarım XP kazandırır.
+EVENT_TRIGGERS = {
+    "book_added": ("kitap_ekleme", "sayfa", "farkli_yazar", "haftalik_sayfa", "aylik_sayfa", "ortak_kitap"),
+    "book_updated": ("sayfa", "farkli_yazar", "haftalik_sayfa", "aylik_sayfa", "ortak_kitap"),
+    "book_deleted": ("silme",),
+    "note_added": ("not_ekleme",),
+    "comment_added": ("yorum",),
+    "followed": ("takip",),
+    "gained_follower": ("takip_edilme",),
+    # Başka bir kullanıcı bu kullanıcının okuduğu bir başlığı ekledi
+    "shared_book": ("ortak_kitap",),
+}
+ALWAYS_TRIGGERS = ("xp", "level")
+ALL_TRIGGERS = tuple({t for triggers in EVENT_TRIGGERS.values() for t in triggers}) + ALWAYS_TRIGGERS
+
+# user_stats sütunundan doğrudan okunan tetikleyiciler
+STAT_TRIGGERS = {
+    "kitap_ekleme": "book_count",
+    "sayfa": "page_total",
+    "not_ekleme": "notes_count",
+    "yorum": "comments_count",
+    "takip": "following",
+    "takip_edilme": "followers",
+    "silme": "deleted_count",
+    "farkli_yazar": "distinct_authors",
+}
+
+
+
+# ------------------ Kural kayıt defteri ------------------
+# achievements tablosu bir kez okunup trigger_type'a göre gruplanmış ve eşiğe
+# göre sıralanmış kurallara derlenir. Eşiği geçilen kurallar bisect ile bulunur.
+# database.catalog_version değişince (insert_achievements) yeniden derlenir.
+class Rule:
+    __slots__ = ("id", "name", "description", "image", "trigger_type", "trigger_value", "xp")
+
+    def __init__(self, id, name, description, image, trigger_type, trigger_value, xp):
+        self.id = id
+        self.name = name
+        self.description = description
+        self.image = image
+        self.trigger_type = trigger_type
+        self.trigger_value = trigger_value
+        self.xp = xp
+
+
+class AchievementRegistry:
+    def __init__(self, rules, version):
+        self.version = version
+        self.rules = sorted(rules, key=lambda rule: rule.id)
+        self.by_id = {rule.id: rule for rule in self.rules}
+        self.by_trigger = {}
+        for rule in self.rules:
+            self.by_trigger.setdefault(rule.trigger_type, []).append(rule)
+        for rules in self.by_trigger.values():
+            rules.sort(key=lambda rule: rule.trigger_value)
+        self._thresholds = {
+            trigger_type: [rule.trigger_value for rule in rules]
+            for trigger_type, rules in self.by_trigger.items()
+        }
+
+    def has_locked(self, trigger_type, unlocked):
+        return any(rule.id not in unlocked for rule in self.by_trigger.get(trigger_type, ()))
+
+    # value değerine kadar eşiği geçilmiş ve henüz açılmamış kurallar
+    def reached(self, trigger_type, value, unlocked):
+        rules = self.by_trigger.get(trigger_type)
+        if not rules:
+            return []
+        end = bisect_right(self._thresholds[trigger_type], value)
+        return [rule for rule in rules[:end] if rule.id not in unlocked]
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry(conn=None):
+    global _registry
+    registry = _registry
+    if registry is not None and registry.version == database.catalog_version:
+        return registry
+
+    with _registry_lock:
+        if _registry is not None and _registry.version == database.catalog_version:
+            return _registry
+        version = database.catalog_version
+        close_conn = conn is None
+        if close_conn:
+            conn = get_connection()
+        try:
+            rows = conn.execute(
+                "SELECT id, name, description, image, trigger_type, trigger_value, xp_reward FROM achievements"
+            ).fetchall()
+        finally:
+            if close_conn:
+                conn.close()
+        _registry = AchievementRegistry([Rule(*row) for row in rows], version)
+        return _registry
+
+
+# Kullanıcı metrikleri: sayaçlar tek satırdan, pencere sorguları yalnızca gerektiğinde
+class _Metrics:
+    def __init__(self, cursor, user_id):
+        self.cursor = cursor
+        self.user_id = user_id
+        self._values = {}
+        self._stats = None
+
+    def set_xp(self, xp, level):
+        self._values["xp"] = xp
+        self._values["level"] = level
+
+    def get(self, trigger_type):
+        if trigger_type not in self._values:
+            self._values[trigger_type] = self._load(trigger_type)
+        return self._values[trigger_type]
+
+    def _load(self, trigger_type):
+        cursor, user_id = self.cursor, self.user_id
+        if trigger_type in STAT_TRIGGERS:
+            if self._stats is None:
+                cursor.execute(f"SELECT {', '.join(STAT_TRIGGERS.values())} FROM user_stats WHERE user_id=?", (user_id,))
+                row = cursor.fetchone() or (0,) * len(STAT_TRIGGERS)
+                self._stats = dict(zip(STAT_TRIGGERS.values(), row))
+            return self._stats[STAT_TRIGGERS[trigger_type]]
+        if trigger_type in ("xp", "level"):
+            cursor.execute("SELECT xp, level FROM users WHERE id=?", (user_id,))
+            row = cursor.fetchone() or (0, 1)
+            self._values["xp"], self._values["level"] = row
+            return self._values[trigger_type]
+        if trigger_type in ("haftalik_sayfa", "aylik_sayfa"):
+            window = "-7 day" if trigger_type == "haftalik_sayfa" else "-1 month"
+            cursor.execute(
+                "SELECT SUM(page) FROM books WHERE user_id=? AND created_at >= date('now', ?)",
+                (user_id, window)
+            )
+            return cursor.fetchone()[0] or 0
+        if trigger_type == "ortak_kitap":
+            cursor.execute("""
+                SELECT COUNT(*)
+                FROM books b1
+                JOIN books b2 ON b1.title = b2.title AND b1.user_id != b2.user_id
+                WHERE b1.user_id=?
+            """, (user_id,))
+            return cursor.fetchone()[0] or 0
+        # Değerlendiricisi olmayan tetikleyiciler açılmaz
+        return None
+
+
+# ------------------ check_achievements + XP ------------------
+# events=None tüm kuralları, aksi halde yalnızca olaylara abone kuralları değerlendirir.
+# Açılan başarımların listesini döndürür; conn verildiyse commit çağıranındır.
+def check_achievements(user_id, conn=None, events=None):
+    close_conn = False
+    if conn is None:
+        conn = get_connection()
+        close_conn = True
+    cursor = conn.cursor()
+
+    if events is None:
+        trigger_types = set(ALL_TRIGGERS)
+    else:
+        trigger_types = set(ALWAYS_TRIGGERS)
+        for event in events:
+            trigger_types.update(EVENT_TRIGGERS.get(event, ()))
+
+    registry = get_registry(conn)
+    cursor.execute("SELECT achievement_id FROM user_achievements WHERE user_id=?", (user_id,))
+    unlocked = {row[0] for row in cursor.fetchall()}
+
+    # Tüm kuralları açılmış tetikleyiciler için metrik bile hesaplanmaz
+    pending_types = [t for t in trigger_types if registry.has_locked(t, unlocked)]
+
+    metrics = _Metrics(cursor, user_id)
+    newly_unlocked = []
+    progress = True
+    # Açılan başarımların XP'si yeni xp/level başarımlarını açabilir
+    while pending_types and progress:
+        progress = False
+        for trigger_type in pending_types:
+            value = metrics.get(trigger_type)
+            if value is None:
+                continue
+            for rule in registry.reached(trigger_type, value, unlocked):
+                cursor.execute(
+                    "INSERT INTO user_achievements (user_id, achievement_id) VALUES (?, ?)",
+                    (user_id, rule.id)
+                )
+                xp_level = add_xp(user_id, rule.xp, conn, reason=f"basarim:{rule.id}")
+                if xp_level:
+                    metrics.set_xp(*xp_level)
+                unlocked.add(rule.id)
+                newly_unlocked.append(rule.name)
+                progress = True
+                print(f"[DEBUG] Açıldı: {rule.name}, +{rule.xp} XP")
+
+    if close_conn:
+        conn.commit()
+        conn.close()
+    return newly_unlocked
+
+
+# ------------------ Toplu başarım backfill ------------------
+# Tüm kullanıcılar için tüm kuralları küme tabanlı sorgularla değerlendirir.
+# Kullanıcılar id sırasıyla parçalara bölünür; her parça tek transaction'dır.
+# Her turda metrikler GROUP BY ile hesaplanır, yeni açılanlar tek bir
+# INSERT ... SELECT ile yazılır ve XP ödülleri tek UPDATE ile verilir.
+# Verilen XP yeni xp/level başarımları açabileceği için tur, yeni başarım
+# kalmayana kadar yalnızca xp/level metrikleriyle tekrarlanır.
+def _fill_metrics(cursor, lo, hi, trigger_types):
+    cursor.execute("DELETE FROM _bf_metrics")
+    selects = []
+    params = []
+    for trigger_type in trigger_types:
+        if trigger_type in STAT_TRIGGERS:
+            selects.append(f"SELECT user_id, '{trigger_type}', {STAT_TRIGGERS[trigger_type]} FROM user_stats WHERE user_id BETWEEN ? AND ?")
+            params += [lo, hi]
+        elif trigger_type in ("xp", "level"):
+            selects.append(f"SELECT id, '{trigger_type}', {trigger_type} FROM users WHERE id BETWEEN ? AND ?")
+            params += [lo, hi]
+        elif trigger_type in ("haftalik_sayfa", "aylik_sayfa"):
+            window = "-7 day" if trigger_type == "haftalik_sayfa" else "-1 month"
+            selects.append(f"""
+                SELECT user_id, '{trigger_type}', SUM(page) FROM books
+                WHERE user_id BETWEEN ? AND ? AND created_at >= date('now', '{window}')
+                GROUP BY user_id
+            """)
+            params += [lo, hi]
+        elif trigger_type == "ortak_kitap":
+            selects.append("""
+                SELECT b1.user_id, 'ortak_kitap', COUNT(*) FROM books b1
+                JOIN books b2 ON b1.title = b2.title AND b1.user_id != b2.user_id
+                WHERE b1.user_id BETWEEN ? AND ?
+                GROUP BY b1.user_id
+            """)
+            params += [lo, hi]
+    if selects:
+        cursor.execute(
+            "INSERT INTO _bf_metrics (user_id, trigger_type, value) " + " UNION ALL ".join(selects),
+            params
+        )
+
+
+def _backfill_chunk(cursor, lo, hi):
+    unlocked = 0
+    trigger_types = ALL_TRIGGERS
+    while True:
+        _fill_metrics(cursor, lo, hi, trigger_types)
+        cursor.execute("DELETE FROM _bf_new")
+        cursor.execute("""
+            INSERT INTO _bf_new (user_id, achievement_id)
+            SELECT m.user_id, a.id
+            FROM _bf_metrics m
+            JOIN achievements a ON a.trigger_type = m.trigger_type AND m.value >= a.trigger_value
+            WHERE NOT EXISTS (
+                SELECT 1 FROM user_achievements ua
+                WHERE ua.user_id = m.user_id AND ua.achievement_id = a.id
+            )
+        """)
+        if cursor.rowcount <= 0:
+            return unlocked
+        unlocked += cursor.rowcount
+
+        # Parça BEGIN IMMEDIATE altında olduğundan NOT EXISTS ile insert arasına başka yazıcı giremez;
+        # OR IGNORE yine de UNIQUE(user_id, achievement_id) çakışmasında parçayı düşürmesin diye
+        cursor.execute("""
+            INSERT OR IGNORE INTO user_achievements (user_id, achievement_id)
+            SELECT user_id, achievement_id FROM _bf_new
+        """)
+        cursor.execute("""
+            INSERT INTO xp_events (user_id, amount, reason)
+            SELECT n.user_id, a.xp_reward, 'basarim:' || a.id
+            FROM _bf_new n
+            JOIN achievements a ON a.id = n.achievement_id
+        """)
+        cursor.execute("""
+            UPDATE users
+            SET xp = users.xp + g.gain,
+                level = (users.xp + g.gain) / 100 + 1
+            FROM (
+                SELECT n.user_id, SUM(a.xp_reward) AS gain
+                FROM _bf_new n
+                JOIN achievements a ON a.id = n.achievement_id
+                GROUP BY n.user_id
+            ) AS g
+            WHERE users.id = g.user_id
+        """)
+        trigger_types = ALWAYS_TRIGGERS
+
+
+def backfill_achievements(chunk_size=1000, conn=None):
+    close_conn = False
+    if conn is None:
+        conn = get_connection()
+        close_conn = True
+    cursor = conn.cursor()
+
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS _bf_metrics (user_id INTEGER, trigger_type TEXT, value INTEGER)")
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS _bf_new (user_id INTEGER, achievement_id INTEGER)")
+    conn.commit()
+
+    users = unlocked = 0
+    last_id = 0
+    try:
+        while True:
+            # Her parça yazma kilidiyle başlar (jobs.AchievementWorker.run_once gibi): WAL'da okuma
+            # olarak başlayan transaction, araya başka bir commit girince yazmaya yükseltilemez (SQLITE_BUSY)
+            conn.execute("BEGIN IMMEDIATE")
+            cursor.execute("SELECT id FROM users WHERE id > ? ORDER BY id LIMIT ?", (last_id, chunk_size))
+            ids = [row[0] for row in cursor.fetchall()]
+            if not ids:
+                conn.rollback()
+                break
+            lo, hi = ids[0], ids[-1]
+            unlocked += _backfill_chunk(cursor, lo, hi)
+            conn.commit()
+            users += len(ids)
+            last_id = hi
+    finally:
+        conn.rollback()
+        for table in ("_bf_metrics", "_bf_new"):
+            cursor.execute(f"DROP TABLE IF EXISTS temp.{table}")
+        invalidate_user_box()
+        if close_conn:
+            conn.close()
+
+    return users, unlocked
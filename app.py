@@ -1,27 +1,123 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
-from database import get_connection, init_db, add_xp, check_achievements,insert_achievements
+from flask import Flask, Response, render_template, request, redirect, url_for, flash, session, jsonify, g
+from flask_socketio import SocketIO, join_room, leave_room
+from database import (ConnectionPool, get_connection, init_db, add_xp, insert_achievements, add_wall_comment, recompute_xp,
+                      get_user_stats, rebuild_user_stats, verify_user_stats, leaderboard_month, prune_leaderboard,
+                      rebuild_leaderboard, get_or_create_work, work_key, trim_timeline,
+                      mark_conversation_read, archive_chat, CHAT_RETENTION_DAYS, LEADERBOARD_KEEP_MONTHS, data_versions)
+from pagination import page_args, split_page, wants_json, decode_cursor, MAX_PAGE_SIZE
+from chat_writer import ChatWriter, FLUSH_INTERVAL, WRITER_SYNCHRONOUS, insert_general_message, insert_private_message
+from cache import user_box_cache, fragment_cache, cached_fragment
+from search import (search_all, search_users, user_match_clause, SEARCH_KINDS, SEARCH_PAGE_SIZE,
+                    USER_SEARCH_LIMIT)
+from achievements import backfill_achievements, get_registry
+from importer import (import_books, parse_books, import_format, BookImportError, IMPORT_CHUNK, IMPORT_FORMATS,
+                      BOOK_XP)
+from exporter import export_user, export_database, EXPORT_FORMATS, EXPORT_MIMETYPES, USER_EXPORTS
+from jobs import enqueue_achievements, enqueue_shared_titles, pending_achievement_jobs, achievement_worker, JOB_MAX_ATTEMPTS
+from markupsafe import Markup
 from werkzeug.security import generate_password_hash, check_password_hash
+import click
+import os
 import sqlite3
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 app = Flask(__name__)
 app.secret_key = "super_secret_key"  # session için gerekli
+socketio = SocketIO(app)
 
 # Uygulama başlarken DB oluştur
 init_db()
 insert_achievements()
-# Kullanıcı kutusu verisi
+achievement_worker.start()  # önceki çalışmadan kalan başarım işleri de işlenir
+
+LIBRARY_PAGE_SIZE = 60
+FEED_PAGE_SIZE = 30
+FEED_INLINE_COMMENTS = 3
+INBOX_PAGE_SIZE = 20
+
+# İstek boyunca tek bir havuz bağlantısı kullanılır, istek bitince havuza döner
+def get_db():
+    if "db" not in g:
+        g.db = get_connection()
+    return g.db
+
+@app.teardown_appcontext
+def release_db(exc):
+    conn = g.pop("db", None)
+    if conn is not None:
+        conn.close()
+    if g.pop("jobs_queued", False):
+        achievement_worker.notify()
+
+# Başarım değerlendirmesi isteğin transaction'ında kuyruğa yazılır; worker istek
+# bittiğinde (commit sonrası) uyandırılır. events=None tüm kurallar demektir.
+def queue_achievements(user_id, events=None):
+    enqueue_achievements(user_id, events, get_db())
+    g.jobs_queued = True
+
+# Başlığı okumuş diğer kullanıcıların ortak kitap başarımları da yeniden değerlendirilir
+def queue_shared_title(user_id, title):
+    enqueue_shared_titles(user_id, [title], get_db())
+    g.jobs_queued = True
+
+# Kullanıcı kutusu verisi: istek içinde g'de, istekler arasında user_box_cache'te tutulur
+# (add_xp commit'ten sonra ve XP yeniden hesaplama önbelleği temizler)
 def get_user_box_data(user_id):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT username, xp, level FROM users WHERE id=?", (user_id,))
-    row = cursor.fetchone()
-    conn.close()
-    if not row:
-        return {"username": "Bilinmiyor", "xp": 0, "level": 1, "progress": 0, "user_id": user_id}
-
-    username, xp, level = row
-    progress = (xp % 100) / 100 * 100
-    return {"username": username, "xp": xp, "level": level, "progress": progress, "user_id": user_id}
+    boxes = g.setdefault("user_boxes", {})
+    box = boxes.get(user_id)
+    if box is not None:
+        return box
+
+    box = user_box_cache.get(user_id)
+    if box is None:
+        # Okuma sürerken bir silme olursa okunan satır eski olabilir; set bunu atlar
+        generation = user_box_cache.generation
+        conn = get_db()
+        cursor = conn.cursor()
+        cursor.execute("SELECT username, xp, level FROM users WHERE id=?", (user_id,))
+        row = cursor.fetchone()
+        if not row:
+            box = {"username": "Bilinmiyor", "xp": 0, "level": 1, "progress": 0, "user_id": user_id}
+        else:
+            username, xp, level = row
+            progress = (xp % 100) / 100 * 100
+            box = {"username": username, "xp": xp, "level": level, "progress": progress, "user_id": user_id}
+            user_box_cache.set(user_id, box, generation=generation)
+
+    boxes[user_id] = box
+    return box
+
+# Herkese aynı görünen sayfa parçası; anahtar (parça, parametreler, veri sürümleri).
+# Önbellekteyse tek sorgu data_versions okumasıdır, yoksa load(conn) ile veri çekilip render edilir.
+def render_fragment(name, params, sources, template, load):
+    conn = get_db()
+    key = (name, params, data_versions(sources, conn))
+    return cached_fragment(key, lambda: Markup(render_template(template, **load(conn))))
+
+# ------------------ Koşullu GET (ETag) ------------------
+# Sık yoklanan uçlar ETag'i satır çekmeden ucuz bir sürümden (son mesaj id'si, veri sürümü)
+# üretir; If-None-Match eşleşirse gövde hiç hazırlanmadan 304 döner. Tarayıcı yanıtı
+# no-cache ile saklayıp her yoklamada kendisi doğrular, istemci kodu değişmez.
+def conditional_json(etag, build):
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = jsonify(build())
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+# Diğer JSON GET yanıtları gövde özetinden ETag alır: sorgu yine çalışır ama değişmeyen yanıt gönderilmez
+@app.after_request
+def json_etag(response):
+    if (request.method == "GET" and response.status_code == 200 and response.mimetype == "application/json"
+            and not response.is_streamed and "ETag" not in response.headers):
+        response.add_etag()
+        response.headers.setdefault("Cache-Control", "private, no-cache")
+        response.make_conditional(request)
+    return response
 
 # ------------------ ROUTES ------------------
 
@@ -40,7 +136,7 @@ def signup():
         return redirect(url_for("index"))
 
     hashed_password = generate_password_hash(password)
-    conn = get_connection()
+    conn = get_db()
     cursor = conn.cursor()
     try:
         cursor.execute("INSERT INTO users (username, email, password) VALUES (?, ?, ?)", 
@@ -49,8 +145,6 @@ def signup():
         flash("✅ Kayıt başarılı! Şimdi giriş yapabilirsiniz.", "success")
     except sqlite3.IntegrityError:
         flash("⚠️ Bu kullanıcı adı zaten alınmış!", "error")
-    finally:
-        conn.close()
 
     return redirect(url_for("index"))
 
@@ -59,11 +153,10 @@ def login():
     username = request.form.get("username")
     password = request.form.get("password")
 
-    conn = get_connection()
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute("SELECT id, username, password FROM users WHERE username=?", (username,))
     user = cursor.fetchone()
-    conn.close()
 
     if user:
         user_id, user_name, stored_hash = user
@@ -87,12 +180,12 @@ def dashboard():
     user_id = session["user_id"]
     user_box = get_user_box_data(user_id)
 
-    conn = get_connection()
+    conn = get_db()
     cursor = conn.cursor()
 
-    # Toplam kitap sayısı
-    cursor.execute("SELECT COUNT(*) FROM books WHERE user_id=?", (user_id,))
-    total_books = cursor.fetchone()[0]
+    # Sayaçlar tek satırdan (user_stats)
+    stats = get_user_stats(user_id, conn)
+    total_books = stats["book_count"]
 
     # Son okunan kitap
     cursor.execute(
@@ -112,13 +205,8 @@ def dashboard():
     weekly_goal = f"{weekly_completed} / 3 Kitap"
 
     # Takipçiler ve takip edilenler
-    cursor.execute("SELECT COUNT(*) FROM follows WHERE following_id=?", (user_id,))
-    followers_count = cursor.fetchone()[0]
-
-    cursor.execute("SELECT COUNT(*) FROM follows WHERE follower_id=?", (user_id,))
-    following_count = cursor.fetchone()[0]
-
-    conn.close()
+    followers_count = stats["followers"]
+    following_count = stats["following"]
 
     return render_template(
         "dashboard.html",
@@ -161,26 +249,30 @@ def add_book():
             flash("⚠️ Kitap adı ve yazar alanları zorunludur.", "error")
             return redirect(url_for("add_book"))
 
-        conn = get_connection()
+        conn = get_db()
         cursor = conn.cursor()
 
         # Aynı kitap var mı kontrol et
         cursor.execute("SELECT id FROM books WHERE title=? AND author=? AND user_id=?", 
                        (title, author, session["user_id"]))
         book_row = cursor.fetchone()
+        events = []
 
         if book_row:
             book_id = book_row[0]
         else:
-            # Kitabı ekle
+            # Kitabı ekle (kanonik esere bağlayarak)
+            work_id = get_or_create_work(title, author, page, conn)
             cursor.execute(
-                "INSERT INTO books (user_id, title, author, page, read_date) VALUES (?, ?, ?, ?, ?)", 
-                (session["user_id"], title, author, page, read_date if read_date else None)
+                "INSERT INTO books (user_id, title, author, page, read_date, work_id) VALUES (?, ?, ?, ?, ?, ?)", 
+                (session["user_id"], title, author, page, read_date if read_date else None, work_id)
             )
             book_id = cursor.lastrowid
+            events.append("book_added")
+            queue_shared_title(session["user_id"], title)
 
             # XP ekle
-            add_xp(session["user_id"], 10, conn=conn)
+            add_xp(session["user_id"], 10, conn=conn, reason="kitap_ekleme")
 
         # Not ekleme varsa
         if notes:
@@ -188,12 +280,12 @@ def add_book():
                 "INSERT INTO notes (book_id, user_id, note) VALUES (?, ?, ?)",
                 (book_id, session["user_id"], notes)
             )
+            events.append("note_added")
 
-        # Tüm başarımları tek sefer kontrol et
-        check_achievements(session["user_id"], conn=conn)
+        # Yalnızca bu olaylara bağlı başarımlar arka planda kontrol edilir
+        queue_achievements(session["user_id"], events)
 
         conn.commit()
-        conn.close()
 
         flash(f"✅ '{title}' kitabı başarıyla eklendi! (+10 XP)", "success")
         return redirect(url_for("dashboard"))
@@ -201,6 +293,72 @@ def add_book():
     return render_template("addbook.html", user_box=user_box)
 
 
+# ------------------ IMPORT ------------------
+# CSV / Goodreads dışa aktarımı / JSON dosyasıyla toplu kitap ekleme (importer.py)
+@app.route("/import_books", methods=["POST"])
+def import_books_route():
+    if "user_id" not in session:
+        flash("⚠️ Lütfen giriş yapın!", "error")
+        return redirect(url_for("index"))
+
+    upload = request.files.get("file")
+    if not upload or not upload.filename:
+        flash("⚠️ Lütfen içe aktarılacak dosyayı seçin.", "error")
+        return redirect(url_for("add_book"))
+
+    fmt = import_format(upload.filename, request.form.get("format"))
+    try:
+        result = import_books(session["user_id"], parse_books(upload.stream, fmt), conn=get_db())
+    except BookImportError as e:
+        # Hatalı satırdan önceki kitaplar (XP ve başarım işleriyle) yazılmış olabilir
+        added = e.result["added"] if e.result else 0
+        if added:
+            achievement_worker.notify()
+            message = f"{added} kitap içe aktarıldı (+{added * BOOK_XP} XP), ardından {e.line}. satırda hata: {e}"
+        else:
+            message = f"Dosya okunamadı ({e.line}. satır): {e}"
+        if wants_json():
+            return jsonify({"error": message, "line": e.line, **(e.result or {})}), 400
+        flash(f"⚠️ {message}", "error")
+        return redirect(url_for("my_books") if added else url_for("add_book"))
+    achievement_worker.notify()
+
+    if wants_json():
+        return jsonify(result)
+    flash(f"✅ {result['added']} kitap içe aktarıldı (+{result['added'] * BOOK_XP} XP). "
+          f"{result['duplicates']} tekrar, {result['invalid']} geçersiz satır atlandı.", "success")
+    return redirect(url_for("my_books"))
+
+
+# ------------------ EXPORT ------------------
+# Akışlı dışa aktarma (exporter.py): yanıt satır satır üretilir, bellekte liste kurulmaz
+def export_response(rows, filename, fmt):
+    return Response(rows, mimetype=EXPORT_MIMETYPES[fmt],
+                    headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@app.route("/export")
+def export():
+    if "user_id" not in session:
+        flash("⚠️ Lütfen giriş yapın!", "error")
+        return redirect(url_for("index"))
+
+    kind = request.args.get("kind", "books")
+    fmt = request.args.get("format", "csv")
+    if kind not in USER_EXPORTS or fmt not in EXPORT_FORMATS:
+        return jsonify({"error": "Geçersiz kind/format"}), 400
+    return export_response(export_user(session["user_id"], kind, fmt), f"{kind}.{fmt}", fmt)
+
+# Tüm veritabanı (parolalar hariç) JSON Lines olarak; yalnızca yöneticiler
+@app.route("/admin/export")
+def admin_export():
+    if "user_id" not in session:
+        return jsonify({"error": "Not logged in"}), 401
+    row = get_db().execute("SELECT is_admin FROM users WHERE id=?", (session["user_id"],)).fetchone()
+    if not row or not row[0]:
+        return jsonify({"error": "Yetkisiz"}), 403
+    return export_response(export_database(), "bookrecorder.jsonl", "jsonl")
+
+
 # ------------------ MY BOOKS ------------------
 
 @app.route("/my_books")
@@ -211,17 +369,32 @@ def my_books():
 
     user_box = get_user_box_data(session["user_id"])
     user_id = session["user_id"]
-    conn = get_connection()
+    conn = get_db()
     cursor = conn.cursor()
 
-    cursor.execute("SELECT id, title, author, read_date, page FROM books WHERE user_id=?", (user_id,))
-    books_rows = cursor.fetchall()
+    after, size = page_args(1)
+    cursor.execute("""
+        SELECT id, title, author, read_date, page FROM books
+        WHERE user_id=? AND id > ?
+        ORDER BY id ASC LIMIT ?
+    """, (user_id, after[0] if after else 0, size + 1))
+    books_rows, next_cursor = split_page(cursor.fetchall(), size, lambda r: (r[0],))
+
+    # Sayfadaki kitapların notları tek sorguda
+    notes_by_book = {}
+    if books_rows:
+        marks = ", ".join("?" for _ in books_rows)
+        cursor.execute(
+            f"SELECT book_id, note FROM notes WHERE user_id=? AND book_id IN ({marks}) ORDER BY id",
+            (user_id, *[b[0] for b in books_rows])
+        )
+        for book_id, note in cursor.fetchall():
+            notes_by_book.setdefault(book_id, []).append(note)
 
     books_list = []
     for book in books_rows:
         book_id, title, author, read_date, page = book
-        cursor.execute("SELECT note FROM notes WHERE book_id=? AND user_id=?", (book_id, user_id))
-        notes = [n[0] for n in cursor.fetchall()]
+        notes = notes_by_book.get(book_id, [])
         notes_text = ' '.join(notes) if notes else ''
         books_list.append({
             "id": book_id,
@@ -232,19 +405,28 @@ def my_books():
             "notes": notes_text
         })
 
-    total_pages = sum([book["page"] for book in books_list if book["page"]])
-    authors = [book["author"] for book in books_list]
-    most_read_author = max(set(authors), key=authors.count) if authors else "Yok"
-    total_books = len(books_list)
+    if wants_json():
+        return jsonify({"items": books_list, "next_cursor": next_cursor})
+
+    stats = get_user_stats(user_id, conn)
+    total_pages = stats["page_total"]
+    total_books = stats["book_count"]
+    cursor.execute("""
+        SELECT author FROM books WHERE user_id=?
+        GROUP BY author ORDER BY COUNT(*) DESC LIMIT 1
+    """, (user_id,))
+    author_row = cursor.fetchone()
+    most_read_author = author_row[0] if author_row else "Yok"
 
-    conn.close()
 
     return render_template("mybooks.html",
                            user_box=user_box,
                            books=books_list,
                            total_pages=total_pages,
                            most_read_author=most_read_author,
-                           total_books=total_books)
+                           total_books=total_books,
+                           next_cursor=next_cursor,
+                           page_size=size)
 
 # ------------------ LIBRARY ------------------
 @app.route("/library")
@@ -254,29 +436,120 @@ def library():
         return redirect(url_for("index"))
 
     user_box = get_user_box_data(session["user_id"])
-    conn = get_connection()
+    after, size = page_args(2, LIBRARY_PAGE_SIZE)
+
+    if wants_json():
+        def build():
+            books, next_cursor = load_library_page(get_db(), after, size)
+            return {"items": books, "next_cursor": next_cursor}
+        versions = data_versions(("books", "users"), get_db())
+        return conditional_json("library-%d-%d" % versions, build)
+
+    def load(conn):
+        books, next_cursor = load_library_page(conn, after, size)
+        return {"books": books, "next_cursor": next_cursor,
+                "is_first_page": after is None, "page_size": size}
+
+    books_html = render_fragment("library", (tuple(after or ()), size), ("books", "users"),
+                                 "_library_books.html", load)
+    return render_template("library.html", user_box=user_box, books_html=books_html)
+
+
+def load_library_page(conn, after, size):
     cursor = conn.cursor()
 
-    cursor.execute("""
-        SELECT b.title, b.author, b.page, u.username
-        FROM books b
-        JOIN users u ON b.user_id = u.id
-        ORDER BY b.title ASC
-    """)
-    rows = cursor.fetchall()
-    conn.close()
+    # Kanonik eserler başlık sırasıyla, (title, id) anahtarından sonrası
+    if after:
+        cursor.execute("""
+            SELECT id, title, author, page
+            FROM works
+            WHERE (title, id) > (?, ?)
+            ORDER BY title ASC, id ASC
+            LIMIT ?
+        """, (after[0], after[1], size + 1))
+    else:
+        cursor.execute("""
+            SELECT id, title, author, page
+            FROM works
+            ORDER BY title ASC, id ASC
+            LIMIT ?
+        """, (size + 1,))
+    rows, next_cursor = split_page(cursor.fetchall(), size, lambda r: (r[1], r[0]))
 
     books_dict = {}
-    for title, author, page, username in rows:
-        key = (title.strip().lower(), author.strip().lower())
-        if key not in books_dict:
-            books_dict[key] = {"title": title, "author": author, "page": page, "users": [username]}
-        else:
-            if username not in books_dict[key]["users"]:
-                books_dict[key]["users"].append(username)
+    for work_id, title, author, page in rows:
+        books_dict[work_id] = {"title": title, "author": author, "page": page, "users": []}
+
+    # Sayfadaki eserlerin okurları tek sorguda
+    if books_dict:
+        marks = ", ".join("?" for _ in books_dict)
+        cursor.execute(f"""
+            SELECT b.work_id, u.username
+            FROM books b
+            JOIN users u ON b.user_id = u.id
+            WHERE b.work_id IN ({marks})
+            GROUP BY b.work_id, u.id
+            ORDER BY MIN(b.id)
+        """, tuple(books_dict))
+        for work_id, username in cursor.fetchall():
+            books_dict[work_id]["users"].append(username)
+
+    return list(books_dict.values()), next_cursor
+
+
+# ------------------ SEARCH ------------------
+def search_args():
+    q = request.args.get("q", "").strip()
+    kind = request.args.get("type", "all")
+    kinds = SEARCH_KINDS if kind not in SEARCH_KINDS else (kind,)
+    page_no = max(request.args.get("page", 1, type=int), 1)
+    size = min(max(request.args.get("size", SEARCH_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    return q, kind, kinds, page_no, size
+
+@app.route("/search")
+def search():
+    if "user_id" not in session:
+        flash("⚠️ Lütfen giriş yapın!", "error")
+        return redirect(url_for("index"))
 
-    books = list(books_dict.values())
-    return render_template("library.html", user_box=user_box, books=books)
+    user_box = get_user_box_data(session["user_id"])
+    q, kind, kinds, page_no, size = search_args()
+    results, has_more = search_all(get_db(), q, kinds, page_no, size)
+    return render_template("search.html", user_box=user_box, q=q, kind=kind,
+                           results=results, has_more=has_more, page_no=page_no, page_size=size)
+
+@app.route("/api/users/search")
+def api_users_search():
+    if "user_id" not in session:
+        return jsonify({"error": "Not logged in"}), 401
+
+    limit = min(max(request.args.get("limit", USER_SEARCH_LIMIT, type=int), 1), MAX_PAGE_SIZE)
+    return jsonify(search_users(get_db(), request.args.get("q", ""), limit))
+
+@app.route("/api/search")
+def api_search():
+    if "user_id" not in session:
+        return jsonify({"error": "Not logged in"}), 401
+
+    q, kind, kinds, page_no, size = search_args()
+    results, has_more = search_all(get_db(), q, kinds, page_no, size)
+    # Snippet'ler kaçışlanmış HTML (<mark> vurgulu) olarak döner
+    for rows in results.values():
+        for row in rows:
+            for key in ("snippet", "title_snippet", "author_snippet"):
+                if key in row:
+                    row[key] = str(row[key])
+    return jsonify({"q": q, "page": page_no, "results": results, "has_more": has_more})
+
+
+# ------------------ CACHE ------------------
+# Bu sürecin önbellek sayaçları (her worker kendi önbelleğini tutar)
+@app.route("/api/cache/stats")
+def api_cache_stats():
+    if "user_id" not in session:
+        return jsonify({"error": "Not logged in"}), 401
+
+    return jsonify({"fragments": fragment_cache.stats(), "user_box": user_box_cache.stats()})
 
 
 # ------------------ SOCIAL ------------------
@@ -291,84 +564,167 @@ def social():
     q = request.args.get("q", "").strip()
     chat_with_id = request.args.get("chat_with", type=int)
 
-    conn = get_connection()
+    conn = get_db()
     cursor = conn.cursor()
 
-    # Kullanıcı arama
+    # Kullanıcı arama, kullanıcı adına göre sayfa sayfa
+    after, size = page_args(1)
+    where, params = ["username > ?"], [after[0] if after else ""]
     if q:
-        cursor.execute("SELECT id, username FROM users WHERE username LIKE ?", ('%' + q + '%',))
-    else:
-        cursor.execute("SELECT id, username FROM users")
-    users = cursor.fetchall()
+        clause, clause_params = user_match_clause(q)
+        where.append(clause)
+        params += clause_params
+    cursor.execute(
+        f"SELECT id, username FROM users WHERE {' AND '.join(where)} ORDER BY username ASC LIMIT ?",
+        (*params, size + 1)
+    )
+    users, next_cursor = split_page(cursor.fetchall(), size, lambda u: (u[1],))
     users_list = [{"id": u[0], "username": u[1]} for u in users]
 
-    # Eğer chat_with_id yoksa, son mesajla konuştuğun kullanıcıyı al
+    if wants_json():
+        return jsonify({"items": users_list, "next_cursor": next_cursor})
+
+    # Eğer chat_with_id yoksa, en son konuştuğun kullanıcıyı al
     if not chat_with_id:
-        cursor.execute("""
-            SELECT sender_id, receiver_id
-            FROM private_messages
-            WHERE sender_id=? OR receiver_id=?
-            ORDER BY created_at DESC LIMIT 1
-        """, (user_id, user_id))
-        last_msg = cursor.fetchone()
-        if last_msg:
-            chat_with_id = last_msg[0] if last_msg[0] != user_id else last_msg[1]
-
-    # Genel mesajları DB'den çek
-    cursor.execute("""
-        SELECT gc.content, u.username, gc.created_at
-        FROM general_chat gc
-        JOIN users u ON gc.user_id = u.id
-        ORDER BY gc.created_at ASC
-    """)
+        last_chat, _ = fetch_inbox(conn, user_id, 1)
+        if last_chat:
+            chat_with_id = last_chat[0]["user_id"]
+
+    # Genel mesajların son sayfası
     general_messages = [
-        (row[0], row[1], row[2][:16])  # YYYY-MM-DD HH:MM format
-        for row in cursor.fetchall()
+        (row[1], row[2], row[3][:16], row[0])  # YYYY-MM-DD HH:MM format
+        for row in fetch_general_messages(conn)
     ]
 
     # Kişisel mesajlar sadece seçilen kişi ile
     private_messages = []
+    chat_with = None
     if chat_with_id:
-        cursor.execute("""
-            SELECT pm.content, u.username, pm.created_at, pm.sender_id, pm.receiver_id
-            FROM private_messages pm
-            JOIN users u ON pm.sender_id = u.id
-            WHERE (pm.sender_id=? AND pm.receiver_id=?) OR (pm.sender_id=? AND pm.receiver_id=?)
-            ORDER BY pm.created_at ASC
-        """, (user_id, chat_with_id, chat_with_id, user_id))
+        cursor.execute("SELECT id, username FROM users WHERE id=?", (chat_with_id,))
+        row = cursor.fetchone()
+        if row:
+            chat_with = {"id": row[0], "username": row[1]}
         private_messages = [
-            (row[0], row[1], row[2][:16], row[3], row[4])
-            for row in cursor.fetchall()
+            (row[1], row[2], row[3][:16], row[4], row[5], row[0])
+            for row in fetch_private_messages(conn, user_id, chat_with_id)
         ]
+        if mark_conversation_read(user_id, chat_with_id, conn):
+            conn.commit()
 
-    conn.close()
 
     return render_template(
         "social.html",
         user_box=user_box,
         users=users_list,
+        next_cursor=next_cursor,
+        page_size=size,
+        chat_with=chat_with,
         general_messages=general_messages,
         private_messages=private_messages,
         current_user_id=user_id,
         chat_with_id=chat_with_id
     )
 
+# ------------------ CHAT GEÇMİŞİ ------------------
+# Mesajlar id sırasıyla okunur: since_id yalnızca daha yenilerini, before_id daha eski
+# geçmişi (limit kadar) getirir; ikisi de verilmezse en son limit mesaj. Sonuç id artan sıradadır.
+CHAT_PAGE_SIZE = 50
+
+def chat_args():
+    since_id = request.args.get("since_id", type=int)
+    before_id = request.args.get("before_id", type=int)
+    limit = min(max(request.args.get("limit", CHAT_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    return since_id, before_id, limit
+
+def fetch_general_messages(conn, since_id=None, before_id=None, limit=CHAT_PAGE_SIZE):
+    cursor = conn.cursor()
+    if since_id is not None:
+        cursor.execute("""
+            SELECT gc.id, gc.content, u.username, gc.created_at
+            FROM general_chat gc
+            JOIN users u ON gc.user_id = u.id
+            WHERE gc.id > ?
+            ORDER BY gc.id ASC LIMIT ?
+        """, (since_id, limit))
+        return cursor.fetchall()
+
+    # Eski geçmiş sıcak tabloda bitince arşivden devam edilir
+    rows = []
+    bound = before_id if before_id is not None else 2**63 - 1
+    for schema in ("main", "archive"):
+        cursor.execute(f"""
+            SELECT gc.id, gc.content, u.username, gc.created_at
+            FROM {schema}.general_chat gc
+            JOIN users u ON gc.user_id = u.id
+            WHERE gc.id < ?
+            ORDER BY gc.id DESC LIMIT ?
+        """, (rows[-1][0] if rows else bound, limit - len(rows)))
+        rows += cursor.fetchall()
+        if len(rows) >= limit:
+            break
+    return rows[::-1]
+
+# İki yön ayrı ayrı (sender_id, receiver_id, id) indeksinden limit kadar okunup birleştirilir
+def _private_page(conn, schema, user_a, user_b, where, order, bound, limit):
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT pm.id, pm.content, u.username, pm.created_at, pm.sender_id, pm.receiver_id
+        FROM (
+            SELECT id FROM (
+                SELECT id FROM {schema}.private_messages WHERE sender_id=? AND receiver_id=? AND {where}
+                ORDER BY id {order} LIMIT ?
+            )
+            UNION
+            SELECT id FROM (
+                SELECT id FROM {schema}.private_messages WHERE sender_id=? AND receiver_id=? AND {where}
+                ORDER BY id {order} LIMIT ?
+            )
+        ) x
+        JOIN {schema}.private_messages pm ON pm.id = x.id
+        JOIN users u ON pm.sender_id = u.id
+        ORDER BY pm.id {order} LIMIT ?
+    """, (user_a, user_b, bound, limit, user_b, user_a, bound, limit, limit))
+    return cursor.fetchall()
+
+def fetch_private_messages(conn, user_a, user_b, since_id=None, before_id=None, limit=CHAT_PAGE_SIZE):
+    if since_id is not None:
+        return _private_page(conn, "main", user_a, user_b, "id > ?", "ASC", since_id, limit)
+
+    # Eski geçmiş sıcak tabloda bitince arşivden devam edilir
+    rows = []
+    bound = before_id if before_id is not None else 2**63 - 1
+    for schema in ("main", "archive"):
+        rows += _private_page(conn, schema, user_a, user_b, "id < ?", "DESC",
+                              rows[-1][0] if rows else bound, limit - len(rows))
+        if len(rows) >= limit:
+            break
+    return rows[::-1]
+
+
+# ETag sürümleri: rowid / (sender_id, receiver_id, id) indeksinin son kaydı, satır okunmaz
+def latest_general_id(conn):
+    return conn.execute("SELECT COALESCE(MAX(id), 0) FROM general_chat").fetchone()[0]
+
+def latest_private_id(conn, user_a, user_b):
+    return conn.execute("""
+        SELECT max(
+            COALESCE((SELECT MAX(id) FROM private_messages WHERE sender_id=? AND receiver_id=?), 0),
+            COALESCE((SELECT MAX(id) FROM private_messages WHERE sender_id=? AND receiver_id=?), 0)
+        )
+    """, (user_a, user_b, user_b, user_a)).fetchone()[0]
+
+
 @app.route("/get_general_messages")
 def get_general_messages():
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT gc.content, u.username, gc.created_at
-        FROM general_chat gc
-        JOIN users u ON gc.user_id = u.id
-        ORDER BY gc.created_at ASC
-    """)
-    messages = [
-        {"msg": row[0], "username": row[1], "time": row[2][:16]}  # YYYY-MM-DD HH:MM
-        for row in cursor.fetchall()
-    ]
-    conn.close()
-    return jsonify(messages)
+    since_id, before_id, limit = chat_args()
+    conn = get_db()
+
+    def build():
+        return [
+            {"id": row[0], "msg": row[1], "username": row[2], "time": row[3][:16]}  # YYYY-MM-DD HH:MM
+            for row in fetch_general_messages(conn, since_id, before_id, limit)
+        ]
+    return conditional_json(f"general-{latest_general_id(conn)}", build)
 
 
 @app.route("/send_general_message", methods=["POST"])
@@ -382,16 +738,33 @@ def send_general_message():
     if not message:
         return jsonify({"error": "Empty message"}), 400
 
-    conn = get_connection()
+    # Mesaj write-behind kuyruğundan toplu yazılır; commit edilince id döner
+    now = datetime.now()
+    try:
+        message_id = insert_general_message(user_id, message, now)
+    except sqlite3.IntegrityError:
+        # Oturumdaki kullanıcı silinmiş
+        return jsonify({"error": "Unknown user"}), 401
+    except (sqlite3.OperationalError, TimeoutError):
+        # Yazıcı veritabanına ulaşamadı; istemci yeniden deneyebilir
+        return jsonify({"error": "Message could not be saved"}), 503
+
+    conn = get_db()
     cursor = conn.cursor()
-    cursor.execute("INSERT INTO general_chat (user_id, content, created_at) VALUES (?, ?, ?)",
-                   (user_id, message, datetime.now()))
-    conn.commit()
-    conn.close()
+    cursor.execute("SELECT username FROM users WHERE id=?", (user_id,))
+    username = cursor.fetchone()[0]
+
+    # Bağlı istemcilere anında gönder
+    time_str = now.strftime("%H:%M")
+    socketio.emit("general_message", {
+        "id": message_id,
+        "msg": message,
+        "username": username,
+        "time": time_str
+    }, to=GENERAL_ROOM)
 
     # Mesaj gönderildikten sonra saat bilgisini döndür
-    time_str = datetime.now().strftime("%H:%M")
-    return jsonify({"time": time_str})
+    return jsonify({"id": message_id, "time": time_str})
 
 
 # ------------------ SEND PRIVATE MESSAGE ------------------
@@ -407,42 +780,153 @@ def send_private_message():
     if not message:
         return jsonify({"error": "Empty message"}), 400
 
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO private_messages (sender_id, receiver_id, content, created_at) VALUES (?, ?, ?, ?)",
-        (user_id, receiver_id, message, datetime.now())
-    )
-    conn.commit()
-    conn.close()
+    # Mesaj write-behind kuyruğundan toplu yazılır; commit edilince id döner
+    now = datetime.now()
+    try:
+        message_id = insert_private_message(user_id, receiver_id, message, now)
+    except sqlite3.IntegrityError:
+        return jsonify({"error": "Unknown receiver"}), 400
+    except (sqlite3.OperationalError, TimeoutError):
+        return jsonify({"error": "Message could not be saved"}), 503
 
-    time_str = datetime.now().strftime("%H:%M")
-    return jsonify({"time": time_str})
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute("SELECT username FROM users WHERE id=?", (user_id,))
+    username = cursor.fetchone()[0]
+
+    # Konuşma odasındaki istemcilere anında gönder
+    time_str = now.strftime("%H:%M")
+    socketio.emit("private_message", {
+        "id": message_id,
+        "msg": message,
+        "username": username,
+        "time": time_str,
+        "sender_id": user_id,
+        "receiver_id": receiver_id
+    }, to=dm_room(user_id, receiver_id))
+
+    return jsonify({"id": message_id, "time": time_str})
 
 @app.route("/get_private_messages/<int:user_id>")
 def get_private_messages(user_id):
     if "user_id" not in session:
         return jsonify([])
 
-    current_id = session["user_id"]
-    conn = get_connection()
+    since_id, before_id, limit = chat_args()
+    me = session["user_id"]
+    conn = get_db()
+
+    # 304'te yeni mesaj yoktur; son 200 yanıtında konuşma zaten okundu işaretlenmiştir
+    def build():
+        msgs = fetch_private_messages(conn, me, user_id, since_id, before_id, limit)
+        if before_id is None and mark_conversation_read(me, user_id, conn):
+            conn.commit()
+        return [{
+            "id": m[0],
+            "msg": m[1],
+            "username": m[2],
+            "time": m[3].split(" ")[1][:5],  # sadece HH:MM
+            "sender_id": m[4]
+        } for m in msgs]
+    return conditional_json(f"private-{me}-{user_id}-{latest_private_id(conn, me, user_id)}", build)
+
+# ------------------ INBOX ------------------
+# Kullanıcının konuşmaları son aktiviteye göre; iki taraf ayrı indekslerden okunup birleştirilir.
+# before: (last_activity, diğer kullanıcı id) cursor'u
+def fetch_inbox(conn, user_id, limit, before=None):
+    bound = before if before else (None, None)
     cursor = conn.cursor()
     cursor.execute("""
-        SELECT pm.content, u.username, pm.created_at, pm.sender_id
-        FROM private_messages pm
-        JOIN users u ON pm.sender_id = u.id
-        WHERE (pm.sender_id=? AND pm.receiver_id=?) OR (pm.sender_id=? AND pm.receiver_id=?)
-        ORDER BY pm.created_at
-    """, (current_id, user_id, user_id, current_id))
-    msgs = cursor.fetchall()
-    conn.close()
+        SELECT x.other_id, u.username, x.last_message_id, x.last_activity, x.unread,
+               COALESCE(pm.content, apm.content)
+        FROM (
+            SELECT * FROM (
+                SELECT user_b AS other_id, last_message_id, last_activity, unread_a AS unread
+                FROM conversations
+                WHERE user_a = ? AND (? IS NULL OR (last_activity, user_b) < (?, ?))
+                ORDER BY last_activity DESC, user_b DESC LIMIT ?
+            )
+            UNION ALL
+            SELECT * FROM (
+                SELECT user_a AS other_id, last_message_id, last_activity, unread_b AS unread
+                FROM conversations
+                WHERE user_b = ? AND user_a != user_b AND (? IS NULL OR (last_activity, user_a) < (?, ?))
+                ORDER BY last_activity DESC, user_a DESC LIMIT ?
+            )
+        ) x
+        JOIN users u ON u.id = x.other_id
+        LEFT JOIN private_messages pm ON pm.id = x.last_message_id
+        LEFT JOIN archive.private_messages apm ON pm.id IS NULL AND apm.id = x.last_message_id
+        ORDER BY x.last_activity DESC, x.other_id DESC
+        LIMIT ?
+    """, (user_id, bound[0], bound[0], bound[1], limit + 1,
+          user_id, bound[0], bound[0], bound[1], limit + 1, limit + 1))
+    rows, next_cursor = split_page(cursor.fetchall(), limit, lambda r: (r[3], r[0]))
+    return [{
+        "user_id": r[0],
+        "username": r[1],
+        "last_message_id": r[2],
+        "last_activity": r[3],
+        "unread": r[4],
+        "last_message": r[5]
+    } for r in rows], next_cursor
+
+@app.route("/api/inbox")
+def api_inbox():
+    if "user_id" not in session:
+        return jsonify({"error": "Not logged in"}), 401
+
+    limit = min(max(request.args.get("limit", INBOX_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    before = decode_cursor(request.args.get("before"), 2)
+    conn = get_db()
+    items, next_cursor = fetch_inbox(conn, session["user_id"], limit, before)
+    return jsonify({"items": items, "next_cursor": next_cursor})
+
+
+# ------------------ SOCKET.IO ------------------
+# Yeni mesajlar odalara push edilir; istemci bağlantı yoksa polling'e döner.
+GENERAL_ROOM = "general"
+
+def dm_room(a, b):
+    a, b = sorted((a, b))
+    return f"dm:{a}:{b}"
+
+@socketio.on("connect")
+def socket_connect():
+    if "user_id" not in session:
+        return False
+    join_room(GENERAL_ROOM)
+
+@socketio.on("join_dm")
+def socket_join_dm(data):
+    if "user_id" not in session:
+        return
+    other_id = (data or {}).get("user_id")
+    if isinstance(other_id, int):
+        join_room(dm_room(session["user_id"], other_id))
+
+# Açık konuşmada push ile gelen mesaj okunmuş sayılır
+@socketio.on("read_dm")
+def socket_read_dm(data):
+    if "user_id" not in session:
+        return
+    other_id = (data or {}).get("user_id")
+    if isinstance(other_id, int):
+        conn = get_connection()
+        try:
+            if mark_conversation_read(session["user_id"], other_id, conn):
+                conn.commit()
+        finally:
+            conn.close()
+
+@socketio.on("leave_dm")
+def socket_leave_dm(data):
+    if "user_id" not in session:
+        return
+    other_id = (data or {}).get("user_id")
+    if isinstance(other_id, int):
+        leave_room(dm_room(session["user_id"], other_id))
 
-    return jsonify([{
-        "msg": m[0],
-        "username": m[1],
-        "time": m[2].split(" ")[1][:5],  # sadece HH:MM
-        "sender_id": m[3]
-    } for m in msgs])
 
 @app.route("/user/<int:user_id>", methods=["GET", "POST"])
 def user_profile(user_id):
@@ -453,21 +937,17 @@ def user_profile(user_id):
     current_user_id = session["user_id"]
     user_box = get_user_box_data(user_id)  # Profil sahibinin bilgisi
 
-    conn = get_connection()
+    conn = get_db()
     cursor = conn.cursor()
 
     # POST: Yorum ekleme
     if request.method == "POST" and "comment" in request.form:
         comment_text = request.form["comment"].strip()
         if comment_text:
-            cursor.execute(
-                "INSERT INTO comments (book_id, user_id, comment) VALUES (?, ?, ?)",
-                (0, current_user_id, comment_text)
-            )
+            add_wall_comment(current_user_id, comment_text, conn)
+            queue_achievements(current_user_id, ["comment_added"])
             conn.commit()
-            conn.close()
             return jsonify({"success": True, "time": datetime.now().strftime("%H:%M")})
-        conn.close()
         return jsonify({"success": False}), 400
 
     # Profil bilgisi
@@ -475,7 +955,6 @@ def user_profile(user_id):
     user_row = cursor.fetchone()
     if not user_row:
         flash("Kullanıcı bulunamadı!", "error")
-        conn.close()
         return redirect(url_for("social"))
     user = {"id": user_row[0], "username": user_row[1]}
 
@@ -484,10 +963,9 @@ def user_profile(user_id):
     is_following = bool(cursor.fetchone())
 
     # Takipçi ve takip edilen sayısı
-    cursor.execute("SELECT COUNT(*) FROM follows WHERE following_id=?", (user_id,))
-    followers_count = cursor.fetchone()[0]
-    cursor.execute("SELECT COUNT(*) FROM follows WHERE follower_id=?", (user_id,))
-    following_count = cursor.fetchone()[0]
+    stats = get_user_stats(user_id, conn)
+    followers_count = stats["followers"]
+    following_count = stats["following"]
 
     # Kullanıcının kitapları
     cursor.execute("""
@@ -540,27 +1018,24 @@ def user_profile(user_id):
     """, (user_id,))
     user_achievements = cursor.fetchall()
 
-    # Private mesajlar
-    cursor.execute("""
-        SELECT pm.content, u.username, pm.created_at, pm.sender_id, pm.receiver_id
-        FROM private_messages pm
-        JOIN users u ON u.id = pm.sender_id
-        WHERE (pm.sender_id=? AND pm.receiver_id=?) OR (pm.sender_id=? AND pm.receiver_id=?)
-        ORDER BY pm.created_at ASC
-    """, (current_user_id, user_id, user_id, current_user_id))
-    private_messages = cursor.fetchall()
+    # Private mesajların son sayfası
+    private_messages = [
+        (row[1], row[2], row[3], row[4], row[5], row[0])
+        for row in fetch_private_messages(conn, current_user_id, user_id)
+    ]
+    if mark_conversation_read(current_user_id, user_id, conn):
+        conn.commit()
 
     # Yorumlar
     cursor.execute("""
         SELECT c.comment, u.username, c.created_at
         FROM comments c
         JOIN users u ON u.id = c.user_id
-        WHERE c.book_id=0
+        WHERE c.book_id IS NULL
         ORDER BY c.created_at ASC
     """)
     comments = cursor.fetchall()
 
-    conn.close()
 
     return render_template(
         "user_profile.html",
@@ -583,25 +1058,27 @@ def user_profile(user_id):
 @app.route("/toggle_follow/<int:user_id>", methods=["POST"])
 def toggle_follow(user_id):
     current_user_id = session["user_id"]
-    conn = get_connection()
+    conn = get_db()
     cursor = conn.cursor()
-    cursor.execute("SELECT user_id FROM follows WHERE follower_id=? AND following_id=?", (current_user_id, user_id))
+    cursor.execute("SELECT 1 FROM follows WHERE follower_id=? AND following_id=?", (current_user_id, user_id))
     is_following = cursor.fetchone() is not None
 
     if is_following:
         cursor.execute("DELETE FROM follows WHERE follower_id=? AND following_id=?", (current_user_id, user_id))
     else:
-        cursor.execute("INSERT INTO follows (follower_id, following_id) VALUES (?, ?)", (current_user_id, user_id))
-
-    # Takip ettikleri sayısını çek
-    cursor.execute("SELECT COUNT(*) FROM follows WHERE follower_id=?", (current_user_id,))
-    total_following = cursor.fetchone()[0]
+        try:
+            cursor.execute("INSERT INTO follows (follower_id, following_id) VALUES (?, ?)", (current_user_id, user_id))
+        except sqlite3.IntegrityError:
+            # Kullanıcı yok (FK) ya da eşzamanlı bir istek takibi zaten ekledi
+            conn.rollback()
+            flash("⚠️ Kullanıcı bulunamadı!", "error")
+            return redirect(url_for("dashboard"))
 
-    # Başarımları kontrol et
-    check_achievements(user_id, conn=conn)
+        # Başarımları kontrol et (takip eden ve takip edilen)
+        queue_achievements(current_user_id, ["followed"])
+        queue_achievements(user_id, ["gained_follower"])
 
     conn.commit()
-    conn.close()
     return redirect(url_for("user_profile", user_id=user_id))
 
 @app.route("/follow/<int:user_id>", methods=["POST"])
@@ -610,7 +1087,7 @@ def follow_user(user_id):
         return jsonify({"success": False, "message": "Giriş yapmalısınız."}), 403
 
     current_user_id = session["user_id"]
-    conn = get_connection()
+    conn = get_db()
     cursor = conn.cursor()
 
     # Takip/Unfollow kontrolü
@@ -619,14 +1096,17 @@ def follow_user(user_id):
     if exists:
         cursor.execute("DELETE FROM follows WHERE follower_id=? AND following_id=?", (current_user_id, user_id))
         conn.commit()
-        conn.close()
         return jsonify({"success": True, "following": False})
     else:
-        cursor.execute("INSERT INTO follows (follower_id, following_id) VALUES (?, ?)", (current_user_id, user_id))
-        conn.commit()
-        conn.close()
+        try:
+            cursor.execute("INSERT INTO follows (follower_id, following_id) VALUES (?, ?)", (current_user_id, user_id))
+        except sqlite3.IntegrityError:
+            conn.rollback()
+            return jsonify({"success": False, "message": "Kullanıcı bulunamadı."}), 404
         # Achievements kontrolü
-        check_achievements(current_user_id)
+        queue_achievements(current_user_id, ["followed"])
+        queue_achievements(user_id, ["gained_follower"])
+        conn.commit()
         return jsonify({"success": True, "following": True})
 
 @app.route("/followers/<string:type>")
@@ -638,36 +1118,47 @@ def followers_list(type):
     user_id = session["user_id"]
     user_box = get_user_box_data(user_id)  # 👈 Kullanıcı verisi alınıyor
 
-    conn = get_connection()
+    conn = get_db()
     cursor = conn.cursor()
 
+    after, size = page_args(1)
+    after_id = after[0] if after else 0
+
     users_list = []
     if type == "followers":
         cursor.execute("""
             SELECT u.id, u.username FROM follows f
             JOIN users u ON f.follower_id = u.id
-            WHERE f.following_id=?
-        """, (user_id,))
-        users_list = cursor.fetchall()
+            WHERE f.following_id=? AND f.follower_id > ?
+            ORDER BY f.follower_id ASC LIMIT ?
+        """, (user_id, after_id, size + 1))
         page_title = "Takipçilerin"
     elif type == "following":
         cursor.execute("""
             SELECT u.id, u.username FROM follows f
             JOIN users u ON f.following_id = u.id
-            WHERE f.follower_id=?
-        """, (user_id,))
-        users_list = cursor.fetchall()
+            WHERE f.follower_id=? AND f.following_id > ?
+            ORDER BY f.following_id ASC LIMIT ?
+        """, (user_id, after_id, size + 1))
         page_title = "Takip Ettiklerin"
     else:
         flash("Geçersiz parametre!", "error")
         return redirect(url_for("dashboard"))
+    users_list, next_cursor = split_page(cursor.fetchall(), size, lambda u: (u[0],))
 
-    conn.close()
+    if wants_json():
+        return jsonify({
+            "items": [{"id": u[0], "username": u[1]} for u in users_list],
+            "next_cursor": next_cursor
+        })
 
     return render_template(
         "followers.html",
         users=users_list,
         page_title=page_title,
+        list_type=type,
+        next_cursor=next_cursor,
+        page_size=size,
         user_box=user_box  # 👈 user_box gönderildi
     )
 
@@ -681,99 +1172,99 @@ def bookdetails(title, author):
     user_id = session["user_id"]
     user_box = get_user_box_data(user_id)  # 👈 Kullanıcı verisini alıyoruz
 
-    conn = get_connection()
+    conn = get_db()
     cursor = conn.cursor()
 
-    # Kitap detaylarını ve notları çek
-    cursor.execute("""
-        SELECT b.id, b.title, b.author, b.page, n.note, u.username
-        FROM books b
-        LEFT JOIN notes n ON b.id = n.book_id
-        LEFT JOIN users u ON n.user_id = u.id
-        WHERE b.title=? AND b.author=?
-        ORDER BY n.id DESC
-    """, (title, author))
-    rows = cursor.fetchall()
-    conn.close()
+    # Kanonik eser
+    cursor.execute(
+        "SELECT id, title, author, page FROM works WHERE title_key=? AND author_key=?",
+        work_key(title, author)
+    )
+    work = cursor.fetchone()
 
-    if not rows:
+    if not work:
         flash("Kitap bulunamadı!", "error")
         return redirect(url_for("library"))
 
     # Kitap bilgisi
     book = {
-        "title": rows[0][1],
-        "author": rows[0][2],
-        "page": rows[0][3]
+        "title": work[1],
+        "author": work[2],
+        "page": work[3]
     }
 
-    # Notları hazırlama
-    notes = [{"note": r[4], "username": r[5]} for r in rows if r[4] is not None]
-
-    return render_template("bookdetails.html", book=book, notes=notes, user_box=user_box)  # 👈 user_box eklendi
+    def load(conn):
+        # Eserin tüm kopyalarındaki notlar
+        cursor = conn.execute("""
+            SELECT n.note, u.username
+            FROM books b
+            JOIN notes n ON b.id = n.book_id
+            LEFT JOIN users u ON n.user_id = u.id
+            WHERE b.work_id=?
+            ORDER BY n.id DESC
+        """, (work[0],))
+        notes = [{"note": r[0], "username": r[1]} for r in cursor.fetchall()]
+        return {"book": book, "notes": notes}
+
+    details = render_fragment("bookdetails", (work[0],), ("books", "notes", "users"),
+                              "_book_notes.html", load)
+    return render_template("bookdetails.html", book=book, details=details, user_box=user_box)  # 👈 user_box eklendi
 @app.route("/leaderboard")
 def leaderboard():
-    conn = get_connection()
-    cursor = conn.cursor()
-
     # user_box için veri
     user_id = session.get("user_id")  # giriş yapan kullanıcı
-    user_box = None
-    if user_id:
-        cursor.execute("SELECT username, xp, level FROM users WHERE id=?", (user_id,))
-        row = cursor.fetchone()
-        if row:
-            username, xp, level = row
-            progress = (xp % 100)
-            user_box = {
-                "username": username,
-                "xp": xp,
-                "level": level,
-                "progress": progress
-            }
-
-    # 1. En çok kitap okuyan kullanıcılar
+    user_box = get_user_box_data(user_id) if user_id else None
+
+    this_month = leaderboard_month()
+    tables = render_fragment("leaderboard", (this_month,), ("books", "users"),
+                             "_leaderboard_tables.html", lambda conn: load_leaderboard(conn, this_month))
+    return render_template("leaderboard.html", tables=tables, user_box=user_box)
+
+
+def load_leaderboard(conn, this_month):
+    cursor = conn.cursor()
+
+    # 1. En çok kitap okuyan kullanıcılar (user_stats üzerinde sıralı indeks)
     cursor.execute("""
-        SELECT u.username, COUNT(b.id) as total_books
-        FROM users u
-        LEFT JOIN books b ON u.id = b.user_id
-        GROUP BY u.id
-        ORDER BY total_books DESC
+        SELECT u.username, s.book_count
+        FROM user_stats s
+        JOIN users u ON u.id = s.user_id
+        ORDER BY s.book_count DESC
         LIMIT 10
     """)
     top_books = cursor.fetchall()
 
     # 2. En çok sayfa okuyan kullanıcılar
     cursor.execute("""
-        SELECT u.username, SUM(b.page) as total_pages
-        FROM users u
-        LEFT JOIN books b ON u.id = b.user_id
-        GROUP BY u.id
-        ORDER BY total_pages DESC
+        SELECT u.username, s.page_total
+        FROM user_stats s
+        JOIN users u ON u.id = s.user_id
+        ORDER BY s.page_total DESC
         LIMIT 10
     """)
     top_pages = cursor.fetchall()
 
-    # 3. Bu ay en çok kitap okuyan kullanıcılar
-    this_month = datetime.now().strftime("%Y-%m")
+    # 3. Bu ay en çok kitap okuyan kullanıcılar (aylık anlık görüntü)
     cursor.execute("""
-        SELECT u.username, COUNT(b.id) as books_this_month
-        FROM users u
-        LEFT JOIN books b ON u.id = b.user_id
-        WHERE b.read_date LIKE ?
-        GROUP BY u.id
-        ORDER BY books_this_month DESC
+        SELECT u.username, m.books
+        FROM leaderboard_monthly m
+        JOIN users u ON u.id = m.user_id
+        WHERE m.month = ? AND m.books > 0
+        ORDER BY m.books DESC
         LIMIT 10
-    """, (f"{this_month}%",))
+    """, (this_month,))
     top_month = cursor.fetchall()
 
-    conn.close()
+    # 4. En çok XP kazanan kullanıcılar
+    cursor.execute("SELECT username, xp FROM users ORDER BY xp DESC LIMIT 10")
+    top_xp = cursor.fetchall()
 
-    return render_template("leaderboard.html",
-                           top_books=top_books,
-                           top_pages=top_pages,
-                           top_month=top_month,
-                           user_box=user_box)
+    return {
+        "top_books": top_books,
+        "top_pages": top_pages,
+        "top_month": top_month,
+        "top_xp": top_xp
+    }
 
 
 @app.route("/add_comment/<int:book_id>", methods=["POST"])
@@ -789,73 +1280,82 @@ def add_comment(book_id):
         flash("Yorum boş olamaz.", "danger")
         return redirect(request.referrer)
 
-    conn = get_connection()
+    conn = get_db()
     cursor = conn.cursor()
 
-    # Yorum ekle
-    cursor.execute(
-        "INSERT INTO comments (book_id, user_id, comment, created_at) VALUES (?, ?, ?, ?)",
-        (book_id, user_id, comment_text, datetime.now())
-    )
+    # Yorum ekle (kitap yoksa ya da az önce silindiyse FK kısıtı reddeder)
+    try:
+        cursor.execute(
+            "INSERT INTO comments (book_id, user_id, comment, created_at) VALUES (?, ?, ?, ?)",
+            (book_id, user_id, comment_text, datetime.now())
+        )
+    except sqlite3.IntegrityError:
+        conn.rollback()
+        flash("⚠️ Kitap bulunamadı!", "error")
+        return redirect(request.referrer or url_for("feed"))
 
     # XP ekle
-    add_xp(user_id, 2, conn=conn)
-
-    # Toplam yorum sayısını çek
-    cursor.execute("SELECT COUNT(*) FROM comments WHERE user_id=?", (user_id,))
-    total_comments = cursor.fetchone()[0]
-
-    # Başarımları kontrol et (yorum ekleme)
-    check_achievements(user_id, conn=conn)
+    add_xp(user_id, 2, conn=conn, reason="yorum")
 
-    # Seviye check (XP sonrası)
-    cursor.execute("SELECT level FROM users WHERE id=?", (user_id,))
-    new_level = cursor.fetchone()[0]
-    check_achievements(user_id, conn=conn)
+    # Başarımları kontrol et (yorum ekleme; XP/level kuralları da dahil)
+    queue_achievements(user_id, ["comment_added"])
 
     conn.commit()
-    conn.close()
 
     flash("Yorumunuz eklendi!", "success")
     return redirect(request.referrer)
 
 
 # ------------------ FEED ------------------
-@app.route("/feed", methods=["GET", "POST"])
-def feed():
-    if "user_id" not in session:
-        flash("⚠️ Lütfen giriş yapın!", "error")
-        return redirect(url_for("index"))
-
-    user_id = session["user_id"]
-    user_box = get_user_box_data(user_id)  # Kullanıcının xp, level, username vs.
-
-    conn = get_connection()
+# Timeline'dan bir sayfa feed öğesi ve yorumları; before: (created_at, book_id) cursor'u
+def load_feed(conn, user_id, limit, before=None, comment_limit=None):
     cursor = conn.cursor()
-
-    # Feed için kitapları al
-    cursor.execute("""
-        SELECT b.id, b.title, b.author, b.page, b.read_date, b.user_id, u.username
-        FROM books b
-        JOIN users u ON b.user_id = u.id
-        WHERE b.user_id IN (SELECT following_id FROM follows WHERE follower_id = ?) OR b.user_id = ?
-        ORDER BY b.created_at DESC
-    """, (user_id, user_id))
-    feed_items = cursor.fetchall()
+    if before:
+        cursor.execute("""
+            SELECT b.id, b.title, b.author, b.page, b.read_date, u.username, t.created_at
+            FROM timeline t
+            JOIN books b ON b.id = t.book_id
+            JOIN users u ON u.id = t.author_id
+            WHERE t.user_id = ? AND (t.created_at, t.book_id) < (?, ?)
+            ORDER BY t.created_at DESC, t.book_id DESC
+            LIMIT ?
+        """, (user_id, before[0], before[1], limit + 1))
+    else:
+        cursor.execute("""
+            SELECT b.id, b.title, b.author, b.page, b.read_date, u.username, t.created_at
+            FROM timeline t
+            JOIN books b ON b.id = t.book_id
+            JOIN users u ON u.id = t.author_id
+            WHERE t.user_id = ?
+            ORDER BY t.created_at DESC, t.book_id DESC
+            LIMIT ?
+        """, (user_id, limit + 1))
+    feed_items, next_cursor = split_page(cursor.fetchall(), limit, lambda r: (r[6], r[0]))
+
+    # Yorumları tek sorguda al (comment_limit verilirse kitap başına ilk N yorum + toplam sayı)
+    comments_by_book = {}
+    counts = {}
+    if feed_items:
+        marks = ", ".join("?" for _ in feed_items)
+        cursor.execute(f"""
+            SELECT book_id, comment, username, total FROM (
+                SELECT c.book_id, c.comment, u.username,
+                       ROW_NUMBER() OVER (PARTITION BY c.book_id ORDER BY c.created_at, c.id) AS rn,
+                       COUNT(*) OVER (PARTITION BY c.book_id) AS total
+                FROM comments c
+                JOIN users u ON c.user_id = u.id
+                WHERE c.book_id IN ({marks})
+            )
+            WHERE ? IS NULL OR rn <= ?
+            ORDER BY book_id, rn
+        """, (*[b[0] for b in feed_items], comment_limit, comment_limit))
+        for book_id, comment, username, total in cursor.fetchall():
+            comments_by_book.setdefault(book_id, []).append((comment, username))
+            counts[book_id] = total
 
     feed_data = []
     for book in feed_items:
-        book_id, title, author, page, read_date, book_user_id, username = book
-
-        # Yorumları al
-        cursor.execute("""
-            SELECT c.comment, u.username FROM comments c
-            JOIN users u ON c.user_id = u.id
-            WHERE c.book_id = ?
-            ORDER BY c.created_at ASC
-        """, (book_id,))
-        comments = cursor.fetchall()
-
+        book_id, title, author, page, read_date, username, created_at = book
         feed_data.append({
             "book_id": book_id,
             "title": title,
@@ -863,17 +1363,52 @@ def feed():
             "page": page,
             "read_date": read_date,
             "username": username,
-            "comments": comments
+            "created_at": created_at,
+            "comments": comments_by_book.get(book_id, []),
+            "comment_count": counts.get(book_id, 0)
         })
+    return feed_data, next_cursor
 
-    conn.close()
+
+@app.route("/api/feed")
+def api_feed():
+    if "user_id" not in session:
+        return jsonify({"error": "Not logged in"}), 401
+
+    limit = min(max(request.args.get("limit", FEED_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    before = decode_cursor(request.args.get("before"), 2)
+
+    conn = get_db()
+    items, next_cursor = load_feed(conn, session["user_id"], limit, before, FEED_INLINE_COMMENTS)
+    for item in items:
+        item["comments"] = [{"username": u, "comment": c} for c, u in item["comments"]]
+    return jsonify({"items": items, "next_cursor": next_cursor})
+
+
+@app.route("/feed", methods=["GET", "POST"])
+def feed():
+    if "user_id" not in session:
+        flash("⚠️ Lütfen giriş yapın!", "error")
+        return redirect(url_for("index"))
+
+    user_id = session["user_id"]
+    user_box = get_user_box_data(user_id)  # Kullanıcının xp, level, username vs.
+
+    conn = get_db()
+
+    # Feed, okuyucunun önceden doldurulmuş timeline'ından okunur
+    if trim_timeline(user_id, conn):
+        conn.commit()
+    feed_data, next_cursor = load_feed(conn, user_id, FEED_PAGE_SIZE)
 
     return render_template(
         "feed.html",
         user_box=user_box,   # Burada user_box’ı template’e gönderiyoruz
         xp=user_box.get("xp", 0),     # XP bilgisi
         level=user_box.get("level", 1), # Level bilgisi
-        feed_data=feed_data
+        feed_data=feed_data,
+        next_cursor=next_cursor,
+        page_size=FEED_PAGE_SIZE
     )
 
 @app.route("/edit/<int:id>", methods=["GET", "POST"])
@@ -883,7 +1418,7 @@ def edit_book(id):
         return redirect(url_for("index"))
 
     user_id = session["user_id"]
-    conn = get_connection()
+    conn = get_db()
     cursor = conn.cursor()
 
     # Kitap kontrolü
@@ -893,7 +1428,6 @@ def edit_book(id):
     )
     book = cursor.fetchone()
     if not book:
-        conn.close()
         flash("❌ Bu kitabı düzenleme izniniz yok veya kitap bulunamadı.", "error")
         return redirect(url_for("my_books"))
 
@@ -913,29 +1447,32 @@ def edit_book(id):
 
         if not title or not author:
             flash("⚠️ Başlık ve Yazar alanları zorunludur.", "error")
-            conn.close()
             return redirect(url_for("edit_book", id=id))
 
         # Kitabı güncelle
+        work_id = get_or_create_work(title, author, page, conn)
         cursor.execute(
-            "UPDATE books SET title=?, author=?, read_date=?, page=? WHERE id=? AND user_id=?",
-            (title, author, read_date, page, id, user_id)
+            "UPDATE books SET title=?, author=?, read_date=?, page=?, work_id=? WHERE id=? AND user_id=?",
+            (title, author, read_date, page, work_id, id, user_id)
         )
+        events = ["book_updated"]
+        if title != book[1]:
+            queue_shared_title(user_id, title)
 
         # Notu ekle veya güncelle
         if note_row:
             cursor.execute("UPDATE notes SET note=? WHERE book_id=? AND user_id=?", (note, id, user_id))
         else:
             cursor.execute("INSERT INTO notes (book_id, user_id, note) VALUES (?, ?, ?)", (id, user_id, note))
+            events.append("note_added")
 
+        queue_achievements(user_id, events)
         conn.commit()
-        conn.close()
 
         flash("✅ Kitap ve not başarıyla güncellendi!", "success")
         return redirect(url_for("my_books"))
 
     user_box = get_user_box_data(user_id)
-    conn.close()
     return render_template("edit_book.html", book=book, note_text=note_text, user_box=user_box)
 
 
@@ -946,7 +1483,7 @@ def delete_book(book_id):
         flash("⚠️ Lütfen giriş yapın!", "error")
         return redirect(url_for("index"))
 
-    conn = get_connection()
+    conn = get_db()
     cursor = conn.cursor()
 
     # Silmeden önce silinen kitabı kaydet
@@ -957,9 +1494,9 @@ def delete_book(book_id):
 
     # Kitabı sil
     cursor.execute("DELETE FROM books WHERE id=? AND user_id=?", (book_id, session["user_id"]))
+    queue_achievements(session["user_id"], ["book_deleted"])
 
     conn.commit()
-    conn.close()
 
     flash("🗑️ Kitap başarıyla silindi!", "success")
     return redirect(url_for("my_books"))
@@ -973,47 +1510,207 @@ def achievements():
 
     user_id = session["user_id"]
 
-    # Yeni başarımları kontrol et
-    check_achievements(user_id)
-
-    conn = get_connection()
+    conn = get_db()
     cursor = conn.cursor()
 
-    # Kullanıcı bilgilerini al (user_box için)
-    cursor.execute("SELECT username, xp, level FROM users WHERE id=?", (user_id,))
-    user_row = cursor.fetchone()
-    user_box = {
-        "username": user_row[0],
-        "xp": user_row[1],
-        "level": user_row[2],
-        "progress": user_row[1] % 100  # progress bar için
-    }
+    # Başarımlar yazma anında kuyruğa alınır (başka kullanıcının eklediği ortak kitap dahil);
+    # sayfa yalnızca değerlendirme bekleyip beklemediğini gösterir, yazma yapmaz.
+    pending = pending_achievement_jobs(user_id, conn)
 
-    # Kullanıcının tüm başarımlarını al
-# Kullanıcının tüm başarımlarını al (güncel ve güvenli versiyon)
-    cursor.execute("""
-    SELECT a.id, a.name, a.description,
-           CASE WHEN ua.user_id IS NOT NULL THEN 1 ELSE 0 END as unlocked
-    FROM achievements a
-    LEFT JOIN user_achievements ua
-    ON a.id = ua.achievement_id AND ua.user_id = ?
-""", (user_id,))
-    achievements_data = cursor.fetchall()
+    # Kullanıcı bilgilerini al (user_box için); worker'ın verdiği XP add_xp ile önbellekten düşer
+    user_box = get_user_box_data(user_id)
+
+    # Kullanıcının açtığı başarımlar; katalog bellekteki kayıt defterinden gelir
+    cursor.execute("SELECT achievement_id FROM user_achievements WHERE user_id=?", (user_id,))
+    unlocked = {row[0] for row in cursor.fetchall()}
 
     # Listeye dönüştür
     achievements_list = []
-    for ach in achievements_data:
+    for rule in get_registry(conn).rules:
         achievements_list.append({
-            "id": ach[0],
-            "name": ach[1],
-            "description": ach[2],
-            "unlocked": bool(ach[3]),
-            "image": f"{ach[0]}.png"  # Her başarıma karşılık gelen görsel dosyası (static/achievements/ içinde)
+            "id": rule.id,
+            "name": rule.name,
+            "description": rule.description,
+            "unlocked": rule.id in unlocked,
+            "image": f"{rule.id}.png"  # Her başarıma karşılık gelen görsel dosyası (static/achievements/ içinde)
         })
 
+    return render_template("achievements.html", user_box=user_box, achievements=achievements_list,
+                           pending=pending)
+
+# ------------------ CLI ------------------
+# flask --app app backfill-achievements --chunk-size 1000
+@app.cli.command("backfill-achievements")
+@click.option("--chunk-size", default=1000, show_default=True, help="Bir transaction'da işlenecek kullanıcı sayısı")
+def backfill_achievements_command(chunk_size):
+    started = time.perf_counter()
+    users, unlocked = backfill_achievements(chunk_size=chunk_size)
+    elapsed = time.perf_counter() - started
+    click.echo(f"✅ {users} kullanıcı tarandı, {unlocked} başarım açıldı ({elapsed:.2f} sn).")
+
+
+# flask --app app rebuild-stats [--verify-only]  (user_stats ve aylık liderlik tablosu)
+@app.cli.command("rebuild-stats")
+@click.option("--verify-only", is_flag=True, help="Yalnızca tutarsız satırları raporla")
+def rebuild_stats_command(verify_only):
+    mismatched = verify_user_stats()
+    if mismatched:
+        click.echo(f"⚠️ {len(mismatched)} kullanıcının sayaçları tutarsız: {mismatched[:20]}")
+    else:
+        click.echo("✅ user_stats ham tablolarla tutarlı.")
+    if not verify_only:
+        rebuilt = rebuild_user_stats()
+        click.echo(f"✅ user_stats yeniden kuruldu ({rebuilt} kullanıcı).")
+        rebuilt = rebuild_leaderboard()
+        click.echo(f"✅ Aylık liderlik tablosu yeniden kuruldu ({rebuilt} satır).")
+
+
+# flask --app app recompute-xp
+@app.cli.command("recompute-xp")
+def recompute_xp_command():
+    fixed = recompute_xp()
+    click.echo(f"✅ XP ledger'dan yeniden hesaplandı, {fixed} kullanıcı düzeltildi.")
+
+# flask --app app prune-leaderboard [--keep-months 12]
+@app.cli.command("prune-leaderboard")
+@click.option("--keep-months", default=LEADERBOARD_KEEP_MONTHS, show_default=True, help="Tutulacak ay sayısı")
+def prune_leaderboard_command(keep_months):
+    pruned = prune_leaderboard(keep_months)
+    click.echo(f"✅ Aylık liderlik tablosundan {pruned} satır budandı.")
+
+@app.cli.command("archive-chat")
+@click.option("--days", default=CHAT_RETENTION_DAYS, show_default=True, help="Sıcak tabloda tutulacak gün sayısı")
+def archive_chat_command(days):
+    moved = archive_chat(days)
+    for table, count in moved.items():
+        click.echo(f"✅ {table}: {count} mesaj arşive taşındı.")
+
+# flask --app app run-jobs [--retry-failed]  (bekleyen başarım işlerini bu süreçte işler)
+@app.cli.command("run-jobs")
+@click.option("--retry-failed", is_flag=True, help="Deneme hakkı bitmiş işleri de yeniden kuyruğa al")
+def run_jobs_command(retry_failed):
+    conn = get_connection()
+    if retry_failed:
+        conn.execute("UPDATE achievement_jobs SET attempts = 0 WHERE attempts >= ?", (JOB_MAX_ATTEMPTS,))
+        conn.commit()
+    started = time.perf_counter()
+    done = achievement_worker.drain()
+    elapsed = time.perf_counter() - started
+    failed = conn.execute(
+        "SELECT COUNT(*) FROM achievement_jobs WHERE attempts >= ?", (JOB_MAX_ATTEMPTS,)
+    ).fetchone()[0]
+    conn.close()
+    click.echo(f"✅ {done} kullanıcının başarım işleri işlendi ({elapsed:.2f} sn).")
+    if failed:
+        click.echo(f"⚠️ {failed} iş deneme hakkını doldurdu, kuyrukta bekliyor.")
+
+# flask --app app import-books KULLANICI DOSYA [--format csv|json|jsonl]
+@app.cli.command("import-books")
+@click.argument("username")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(IMPORT_FORMATS), default=None, help="Varsayılan: dosya uzantısı")
+@click.option("--chunk-size", default=IMPORT_CHUNK, show_default=True, help="Bir transaction'da yazılacak kitap sayısı")
+def import_books_command(username, path, fmt, chunk_size):
+    conn = get_connection()
+    row = conn.execute("SELECT id FROM users WHERE username=?", (username,)).fetchone()
+    if row is None:
+        conn.close()
+        raise click.ClickException(f"Kullanıcı bulunamadı: {username}")
+
+    started = time.perf_counter()
+    try:
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            result = import_books(row[0], parse_books(f, import_format(path, fmt)), conn=conn, chunk_size=chunk_size)
+    except BookImportError as e:
+        added = e.result["added"] if e.result else 0
+        achievement_worker.drain()
+        raise click.ClickException(f"{added} kitap içe aktarıldı, ardından {e.line}. satırda hata: {e}")
+    finally:
+        conn.close()
+    achievement_worker.drain()
+    elapsed = time.perf_counter() - started
+    click.echo(f"✅ {result['added']} kitap, {result['notes']} not eklendi ({elapsed:.2f} sn). "
+               f"Atlanan: {result['duplicates']} tekrar, {result['unread']} okunmamış, {result['invalid']} geçersiz.")
+
+# flask --app app export --user KULLANICI [--kind books|comments] [--format csv|jsonl] [-o DOSYA]
+# flask --app app export --all [-o DOSYA]  (tüm veritabanı, JSON Lines)
+@app.cli.command("export")
+@click.option("--user", "username", default=None, help="Dışa aktarılacak kullanıcı")
+@click.option("--all", "whole_db", is_flag=True, help="Tüm veritabanını dışa aktar (parolalar hariç)")
+@click.option("--kind", type=click.Choice(tuple(USER_EXPORTS)), default="books", show_default=True)
+@click.option("--format", "fmt", type=click.Choice(EXPORT_FORMATS), default="csv", show_default=True)
+@click.option("-o", "--output", type=click.File("w", encoding="utf-8"), default="-", help="Varsayılan: stdout")
+def export_command(username, whole_db, kind, fmt, output):
+    if whole_db:
+        rows = export_database()
+    elif username:
+        conn = get_connection()
+        row = conn.execute("SELECT id FROM users WHERE username=?", (username,)).fetchone()
+        conn.close()
+        if row is None:
+            raise click.ClickException(f"Kullanıcı bulunamadı: {username}")
+        rows = export_user(row[0], kind, fmt)
+    else:
+        raise click.UsageError("--user ya da --all verilmeli")
+    for line in rows:
+        output.write(line)
+
+# flask --app app set-admin KULLANICI [--revoke]
+@app.cli.command("set-admin")
+@click.argument("username")
+@click.option("--revoke", is_flag=True, help="Yönetici yetkisini kaldır")
+def set_admin_command(username, revoke):
+    conn = get_connection()
+    updated = conn.execute("UPDATE users SET is_admin=? WHERE username=?", (0 if revoke else 1, username)).rowcount
+    conn.commit()
     conn.close()
+    if not updated:
+        raise click.ClickException(f"Kullanıcı bulunamadı: {username}")
+    click.echo(f"✅ {username} yönetici yetkisi {'kaldırıldı' if revoke else 'verildi'}.")
+
+@app.cli.command("bench-chat")
+@click.option("--messages", default=2000, show_default=True, help="Gönderilecek toplam mesaj sayısı")
+@click.option("--threads", default=8, show_default=True, help="Eşzamanlı gönderen sayısı")
+@click.option("--interval", default=FLUSH_INTERVAL, show_default=True, help="Yazıcının parti bekleme süresi (sn)")
+def bench_chat_command(messages, threads, interval):
+    # Geçici bir veritabanında mesaj başına commit ile write-behind yazıcıyı karşılaştırır
+    with tempfile.TemporaryDirectory() as tmp:
+        bench_pool = ConnectionPool(os.path.join(tmp, "bench.db"), size=threads + 1)
+        conn = get_connection()
+        schema = conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type IN ('table', 'index') AND tbl_name IN ('users', 'general_chat') "
+            "AND sql IS NOT NULL"
+        ).fetchall()
+        conn.close()
+        conn = bench_pool.acquire()
+        for (sql,) in schema:
+            conn.execute(sql)
+        conn.execute("INSERT INTO users (username, password, email) VALUES ('bench', '-', 'bench@example.com')")
+        conn.commit()
+        conn.close()
 
-    return render_template("achievements.html", user_box=user_box, achievements=achievements_list)
+        # Karşılaştırma adil olsun: her iki yol da yazıcının dayanıklılık ayarıyla commit eder
+        def direct(i):
+            c = bench_pool.acquire()
+            try:
+                c.execute(f"PRAGMA synchronous={WRITER_SYNCHRONOUS}")
+                c.execute("INSERT INTO general_chat (user_id, content, created_at) VALUES (?, ?, ?)",
+                          (1, f"mesaj {i}", datetime.now()))
+                c.commit()
+            finally:
+                c.close()
+
+        writer = ChatWriter(connect=bench_pool.acquire, interval=interval)
+        def batched(i):
+            insert_general_message(1, f"mesaj {i}", datetime.now(), writer=writer)
+
+        for name, send in (("mesaj başına commit", direct), ("write-behind", batched)):
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=threads) as pool:
+                list(pool.map(send, range(messages)))
+            elapsed = time.perf_counter() - start
+            click.echo(f"{name:>22}: {messages / elapsed:8.0f} mesaj/sn ({elapsed:.2f} sn)")
+        bench_pool.close_all()
 
 if __name__ == "__main__":
-    app.run(debug=True)
+    socketio.run(app, debug=True)
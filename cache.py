@@ -0,0 +1,85 @@
+import threading
+import time
+from collections import OrderedDict
+
+# ------------------ Süreç içi önbellek ------------------
+# Küçük bir TTL + LRU önbellek; her worker sürecinin kendi kopyası vardır, bu yüzden
+# başka süreçlerdeki yazmalar en geç ttl sonra görünür. Yazma yolları ilgili anahtarı siler.
+
+
+class TTLCache:
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0  # her silmede artar
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    # generation verilirse (değer okunmadan önceki self.generation) arada bir silme olduysa
+    # değer yazılmaz: silmeden önce okunmuş eski veri önbelleğe geri girmesin
+    def set(self, key, value, ttl=None, generation=None):
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self.generation += 1
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+# Sayfa başlığındaki kullanıcı kutusu (username, xp, level)
+USER_BOX_TTL = 60
+user_box_cache = TTLCache(maxsize=2048, ttl=USER_BOX_TTL)
+
+
+# add_xp (commit'ten sonra), XP yeniden hesaplama ve başarım backfill'i bunu çağırır.
+# Aynı süreçte silmeden sonra eski değer görünmez; diğer süreçler en geç USER_BOX_TTL sonra görür.
+def invalidate_user_box(user_id=None):
+    if user_id is None:
+        user_box_cache.clear()
+    else:
+        user_box_cache.delete(user_id)
+
+
+# ------------------ Parça önbelleği ------------------
+# Herkese aynı görünen sayfa parçalarının render edilmiş HTML'i. Anahtar veri sürümlerini
+# içerdiğinden silme gerekmez; eski sürümlü girişler LRU/TTL ile düşer.
+FRAGMENT_TTL = 300
+fragment_cache = TTLCache(maxsize=512, ttl=FRAGMENT_TTL)
+
+
+def cached_fragment(key, render):
+    html = fragment_cache.get(key)
+    if html is None:
+        html = render()
+        fragment_cache.set(key, html)
+    return html
@@ -0,0 +1,158 @@
+import os
+import queue
+import threading
+import time
+
+from database import get_connection
+
+# ------------------ Write-behind sohbet yazıcısı ------------------
+# İstek thread'leri mesajı kuyruğa bırakır ve commit'i bekler; tek bir yazıcı thread
+# biriken mesajları (en fazla FLUSH_MAX) tek transaction'da yazar. Böylece yoğun
+# sohbette her mesaj ayrı commit/yazma kilidi almaz. FLUSH_INTERVAL > 0 ise parti
+# dolana kadar o kadar beklenir; kapalı döngü ölçümlerde (flask bench-chat) bekleme
+# yalnızca gecikme eklediğinden varsayılan 0'dır.
+# Gönderene id ancak commit diske işlenince döner: havuzun synchronous=NORMAL ayarı WAL'da
+# elektrik kesintisinde son commit'leri kaybedebileceğinden yazıcı bağlantısı parti süresince
+# synchronous=FULL'a alınır (her commit'te WAL fsync); maliyet parti başına bir kez ödenir.
+FLUSH_INTERVAL = 0       # saniye
+FLUSH_MAX = 100
+SUBMIT_TIMEOUT = 5
+WRITER_SYNCHRONOUS = "FULL"
+CONNECT_RETRIES = 3
+CONNECT_BACKOFF = 0.1    # saniye; her denemede iki katına çıkar (toplam SUBMIT_TIMEOUT'un altında)
+
+
+class _Pending:
+    __slots__ = ("sql", "params", "row_id", "error", "done")
+
+    def __init__(self, sql, params):
+        self.sql = sql
+        self.params = params
+        self.row_id = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class ChatWriter:
+    def __init__(self, connect=get_connection, interval=FLUSH_INTERVAL, max_batch=FLUSH_MAX):
+        self._connect = connect
+        self.interval = interval
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_thread(self):
+        # Fork sonrası (ya da ilk kullanımda) yazıcı thread bu süreçte başlatılır
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid != os.getpid() or not self._thread.is_alive():
+                self._queue = queue.Queue()
+                self._thread = threading.Thread(target=self._run, name="chat-writer", daemon=True)
+                self._pid = os.getpid()
+                self._thread.start()
+
+    # Satır commit edilince id'sini döndürür; yazılamazsa hatayı çağırana iletir
+    def submit(self, sql, params, timeout=SUBMIT_TIMEOUT):
+        item = _Pending(sql, params)
+        self._ensure_thread()
+        self._queue.put(item)
+        if not item.done.wait(timeout):
+            raise TimeoutError("Sohbet mesajı zamanında yazılamadı")
+        if item.error is not None:
+            raise item.error
+        return item.row_id
+
+    def _run(self):
+        while True:
+            # Önceki flush sürerken biriken her şey bir sonraki transaction'a girer (group commit);
+            # interval > 0 ise seyrek trafikte de o kadar beklenip daha büyük parti toplanır
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                    continue
+                except queue.Empty:
+                    pass
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self._flush(batch)
+            except Exception as e:
+                # Thread ölürse sonraki her mesaj SUBMIT_TIMEOUT bekler; hata yazılıp devam edilir
+                print(f"⚠️ Sohbet yazıcısı hatası: {e}")
+
+    # Bağlantı açılamazsa (ör. disk/dosya hatası) kısa beklemelerle yeniden denenir
+    def _open(self):
+        delay = CONNECT_BACKOFF
+        for attempt in range(CONNECT_RETRIES):
+            try:
+                return self._connect()
+            except Exception:
+                if attempt == CONNECT_RETRIES - 1:
+                    raise
+                time.sleep(delay)
+                delay *= 2
+
+    def _flush(self, batch):
+        conn = None
+        previous_sync = None
+        try:
+            conn = self._open()
+            # Havuz bağlantısı geri verilirken önceki ayar geri yüklenir
+            previous_sync = conn.execute("PRAGMA synchronous").fetchone()[0]
+            conn.execute(f"PRAGMA synchronous={WRITER_SYNCHRONOUS}")
+            try:
+                for item in batch:
+                    item.row_id = conn.execute(item.sql, item.params).lastrowid
+                conn.commit()
+            except Exception:
+                # Toplu yazım bozulursa (ör. FK hatası) mesajlar tek tek denenir,
+                # yalnızca hatalı olan reddedilir
+                conn.rollback()
+                for item in batch:
+                    try:
+                        item.row_id = conn.execute(item.sql, item.params).lastrowid
+                        conn.commit()
+                    except Exception as e:
+                        conn.rollback()
+                        item.row_id = None
+                        item.error = e
+        except Exception as e:
+            for item in batch:
+                item.error = item.error or e
+        finally:
+            # Bekleyen göndericiler bağlantı kapanırken hata olsa da uyandırılır
+            for item in batch:
+                item.done.set()
+            if conn is not None:
+                try:
+                    if previous_sync is not None:
+                        conn.execute(f"PRAGMA synchronous={previous_sync}")
+                finally:
+                    conn.close()
+
+
+chat_writer = ChatWriter()
+
+
+def insert_general_message(user_id, content, created_at, writer=chat_writer):
+    return writer.submit(
+        "INSERT INTO general_chat (user_id, content, created_at) VALUES (?, ?, ?)",
+        (user_id, content, created_at)
+    )
+
+
+def insert_private_message(sender_id, receiver_id, content, created_at, writer=chat_writer):
+    return writer.submit(
+        "INSERT INTO private_messages (sender_id, receiver_id, content, created_at) VALUES (?, ?, ?, ?)",
+        (sender_id, receiver_id, content, created_at)
+    )
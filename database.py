@@ -1,10 +1,137 @@
+import os
+import queue
 import sqlite3
+import threading
 from datetime import datetime, timedelta
 
+from cache import invalidate_user_box
+from migrations import (migrate, verify_query_plans, USER_STATS_ACTUAL, LEADERBOARD_MONTHLY_ACTUAL,
+                        TIMELINE_KEEP)
+
 DB_NAME = "database.db"
+ARCHIVE_DB_NAME = "archive.db"
+
+USER_STATS_COLUMNS = ("book_count", "page_total", "notes_count", "comments_count",
+                      "followers", "following", "deleted_count", "distinct_authors")
+
+# ------------------ Connection pool ------------------
+# Her bağlantı bir kez açılıp PRAGMA'ları ayarlanır, sonra havuza geri döner.
+POOL_SIZE = 8
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA foreign_keys=ON",
+    "PRAGMA cache_size=-16000",      # ~16 MB sayfa önbelleği
+    "PRAGMA mmap_size=134217728",    # 128 MB
+    "PRAGMA temp_store=MEMORY",
+)
+
+
+# sqlite3 bağlantısını sarar; close() bağlantıyı kapatmak yerine havuza iade eder
+class PooledConnection:
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+        self._after_commit = []
+
+    def __getattr__(self, name):
+        if self._raw is None:
+            raise sqlite3.ProgrammingError("Cannot operate on a closed database.")
+        return getattr(self._raw, name)
+
+    def __enter__(self):
+        return self._raw.__enter__()
+
+    def __exit__(self, *exc):
+        result = self._raw.__exit__(*exc)
+        self._finish(exc[0] is None)
+        return result
+
+    # Transaction commit edilince çalışacak geri çağırma (ör. önbellek silme); rollback'te atılır
+    def after_commit(self, callback):
+        self._after_commit.append(callback)
+
+    def _finish(self, committed):
+        callbacks, self._after_commit = self._after_commit, []
+        if committed:
+            for callback in callbacks:
+                callback()
+
+    def commit(self):
+        self._raw.commit()
+        self._finish(True)
+
+    def rollback(self):
+        self._raw.rollback()
+        self._finish(False)
+
+    def close(self):
+        if self._raw is None:
+            return
+        raw, self._raw = self._raw, None
+        self._after_commit = []
+        self._pool.release(raw)
+
+
+class ConnectionPool:
+    def __init__(self, db_name, size=POOL_SIZE, attach=None):
+        self.db_name = db_name
+        self.size = size
+        self.attach = attach or {}
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def _open(self):
+        raw = sqlite3.connect(self.db_name, timeout=5, check_same_thread=False)
+        for pragma in PRAGMAS:
+            raw.execute(pragma)
+        for alias, path in self.attach.items():
+            raw.execute(f"ATTACH DATABASE ? AS {alias}", (path,))
+        return raw
+
+    def _reset_after_fork(self):
+        # Fork edilen worker ebeveynin bağlantılarını kullanmamalı
+        with self._lock:
+            if self._pid != os.getpid():
+                self._idle = queue.LifoQueue(maxsize=self.size)
+                self._pid = os.getpid()
+
+    def acquire(self):
+        if self._pid != os.getpid():
+            self._reset_after_fork()
+        try:
+            raw = self._idle.get_nowait()
+        except queue.Empty:
+            raw = self._open()
+        return PooledConnection(self, raw)
+
+    def release(self, raw):
+        # Commit edilmemiş değişiklikler, sqlite3.close() davranışındaki gibi atılır
+        if raw.in_transaction:
+            raw.rollback()
+        if self._pid != os.getpid():
+            raw.close()
+            return
+        try:
+            self._idle.put_nowait(raw)
+        except queue.Full:
+            raw.close()
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_pool = ConnectionPool(DB_NAME, attach={"archive": ARCHIVE_DB_NAME})
+
 
 def get_connection():
-    return sqlite3.connect(DB_NAME)
+    return _pool.acquire()
 
 def init_db():
 
@@ -130,227 +257,380 @@ CREATE TABLE IF NOT EXISTS user_achievements (
 """)
 
     conn.commit()
+
+    # Şema migrasyonları ve sıcak sorguların plan kontrolü
+    migrate(conn)
+    init_archive(conn)
+    for name, detail in verify_query_plans(conn):
+        print(f"⚠️ Sorgu planı tam tarama yapıyor: {name} -> {detail}")
+
     conn.close()
     print("✅ Veritabanı ve tablolar oluşturuldu veya zaten mevcut.")
 
-# Başarımları veritabanına ekleme
+# Başarımları veritabanına ekleme: (ad, açıklama, görsel, trigger_type, trigger_value, xp ödülü)
 def insert_achievements():
     achievements_list = [
-        ("İlk Kitap!", "İlk kitabını ekledin.", "1.png", "kitap_ekleme", 1),
-        ("5 Kitap Okudun!", "5 kitap ekledin.", "2.png", "kitap_ekleme", 5),
-        ("10 Kitap Okudun!", "10 kitap ekledin.", "3.png", "kitap_ekleme", 10),
-        ("25 Kitap Okudun!", "25 kitap ekledin.", "4.png", "kitap_ekleme", 25),
-        ("50 Kitap Okudun!", "50 kitap ekledin.", "5.png", "kitap_ekleme", 50),
-        ("İlk Tamamlanan Kitap", "Bir kitabı okundu olarak işaretledin.", "6.png", "kitap_ekleme", 1),
-        ("Haftanın Kitapçısı", "Bir haftada 3 kitap ekledin.", "7.png", "haftalik_kitap", 3),
-        ("Ayın Kitapçısı", "Bir ayda 10 kitap ekledin.", "8.png", "aylik_kitap", 10),
-        ("Sayfa Maratoncusu", "Toplam 1000 sayfa okudun.", "9.png", "sayfa", 1000),
-        ("Sayfa Maratoncusu II", "Toplam 5000 sayfa okudun.", "10.png", "sayfa", 5000),
-        ("Sayfa Maratoncusu III", "Toplam 10.000 sayfa okudun.", "11.png", "sayfa", 10000),
-        ("Çok Okuyan Yazar", "Aynı yazardan 5 kitap ekledin.", "12.png", "yazar", 5),
-        ("Kitap Koleksiyoncusu", "20 farklı yazardan kitap ekledin.", "13.png", "farkli_yazar", 20),
-        ("İlk Not", "Bir kitap için not ekledin.", "14.png", "not_ekleme", 1),
-        ("Not Tutkunu", "10 farklı kitaba not ekledin.", "15.png", "not_ekleme", 10),
-        ("Detaycı", "50 not ekledin.", "16.png", "not_ekleme", 50),
-        ("Popüler Yorumcu", "50 yorum yaptın.", "17.png", "yorum", 50),
-        ("İlk Takip", "Başkasını takip ettin.", "18.png", "takip", 1),
-        ("Takipçi Kazan!", "Bir kullanıcı seni takip etmeye başladı.", "19.png", "takip_edilme", 1),
-        ("Takipçi Ormanı", "10 takipçin oldu.", "20.png", "takip_edilme", 10),
-        ("Sosyal Kuş", "10 kullanıcıyı takip ettin.", "21.png", "takip", 10),
-        ("Süper Sosyal", "50 kullanıcıyı takip ettin.", "22.png", "takip", 50),
-        ("Ortak Zevk", "Başka bir kullanıcı ile aynı kitabı okudun.", "23.png", "ortak_kitap", 1),
-        ("Kitap Arkadaşım", "5 ortak kitabın var.", "24.png", "ortak_kitap", 5),
-        ("Seviye 2’ye Hoşgeldin", "Level 2’ye ulaştın.", "25.png", "level", 2),
-        ("Seviye 5’e Hoşgeldin", "Level 5’e ulaştın.", "26.png", "level", 5),
-        ("Seviye 10’a Hoşgeldin", "Level 10’a ulaştın.", "27.png", "level", 10),
-        ("XP Canavarı", "Toplam 100 XP kazandın.", "28.png", "xp", 100),
-        ("XP Yıldızı", "Toplam 500 XP kazandın.", "29.png", "xp", 500),
-        ("XP Efsanesi", "Toplam 1000 XP kazandın.", "30.png", "xp", 1000),
-        ("Okuma Maratoncusu", "Bir hafta içinde 500 sayfa okudun.", "31.png", "haftalik_sayfa", 500),
-        ("Ayın Maratoncusu", "Bir ayda 2000 sayfa okudun.", "32.png", "aylik_sayfa", 2000),
-        ("Yorumcu Arkadaş", "Başkasının feed’ine yorum yaptın.", "33.png", "yorum", 1),
-        ("Kitap Silici", "Bir kitabı sildin.", "34.png", "silme", 1),
+        ("İlk Kitap!", "İlk kitabını ekledin.", "1.png", "kitap_ekleme", 1, 50),
+        ("5 Kitap Okudun!", "5 kitap ekledin.", "2.png", "kitap_ekleme", 5, 100),
+        ("10 Kitap Okudun!", "10 kitap ekledin.", "3.png", "kitap_ekleme", 10, 200),
+        ("25 Kitap Okudun!", "25 kitap ekledin.", "4.png", "kitap_ekleme", 25, 300),
+        ("50 Kitap Okudun!", "50 kitap ekledin.", "5.png", "kitap_ekleme", 50, 500),
+        ("İlk Tamamlanan Kitap", "Bir kitabı okundu olarak işaretledin.", "6.png", "kitap_ekleme", 1, 50),
+        ("Haftanın Kitapçısı", "Bir haftada 3 kitap ekledin.", "7.png", "haftalik_kitap", 3, 150),
+        ("Ayın Kitapçısı", "Bir ayda 10 kitap ekledin.", "8.png", "aylik_kitap", 10, 250),
+        ("Sayfa Maratoncusu", "Toplam 1000 sayfa okudun.", "9.png", "sayfa", 1000, 100),
+        ("Sayfa Maratoncusu II", "Toplam 5000 sayfa okudun.", "10.png", "sayfa", 5000, 250),
+        ("Sayfa Maratoncusu III", "Toplam 10.000 sayfa okudun.", "11.png", "sayfa", 10000, 500),
+        ("Çok Okuyan Yazar", "Aynı yazardan 5 kitap ekledin.", "12.png", "yazar", 5, 100),
+        ("Kitap Koleksiyoncusu", "20 farklı yazardan kitap ekledin.", "13.png", "farkli_yazar", 20, 150),
+        ("İlk Not", "Bir kitap için not ekledin.", "14.png", "not_ekleme", 1, 50),
+        ("Not Tutkunu", "10 farklı kitaba not ekledin.", "15.png", "not_ekleme", 10, 100),
+        ("Detaycı", "50 not ekledin.", "16.png", "not_ekleme", 50, 200),
+        ("Popüler Yorumcu", "50 yorum yaptın.", "17.png", "yorum", 50, 100),
+        ("İlk Takip", "Başkasını takip ettin.", "18.png", "takip", 1, 50),
+        ("Takipçi Kazan!", "Bir kullanıcı seni takip etmeye başladı.", "19.png", "takip_edilme", 1, 50),
+        ("Takipçi Ormanı", "10 takipçin oldu.", "20.png", "takip_edilme", 10, 150),
+        ("Sosyal Kuş", "10 kullanıcıyı takip ettin.", "21.png", "takip", 10, 100),
+        ("Süper Sosyal", "50 kullanıcıyı takip ettin.", "22.png", "takip", 50, 250),
+        ("Ortak Zevk", "Başka bir kullanıcı ile aynı kitabı okudun.", "23.png", "ortak_kitap", 1, 50),
+        ("Kitap Arkadaşım", "5 ortak kitabın var.", "24.png", "ortak_kitap", 5, 100),
+        ("Seviye 2’ye Hoşgeldin", "Level 2’ye ulaştın.", "25.png", "level", 2, 50),
+        ("Seviye 5’e Hoşgeldin", "Level 5’e ulaştın.", "26.png", "level", 5, 100),
+        ("Seviye 10’a Hoşgeldin", "Level 10’a ulaştın.", "27.png", "level", 10, 200),
+        ("XP Canavarı", "Toplam 100 XP kazandın.", "28.png", "xp", 100, 50),
+        ("XP Yıldızı", "Toplam 500 XP kazandın.", "29.png", "xp", 500, 100),
+        ("XP Efsanesi", "Toplam 1000 XP kazandın.", "30.png", "xp", 1000, 200),
+        ("Okuma Maratoncusu", "Bir hafta içinde 500 sayfa okudun.", "31.png", "haftalik_sayfa", 500, 100),
+        ("Ayın Maratoncusu", "Bir ayda 2000 sayfa okudun.", "32.png", "aylik_sayfa", 2000, 250),
+        ("Yorumcu Arkadaş", "Başkasının feed’ine yorum yaptın.", "33.png", "yorum", 1, 50),
+        ("Kitap Silici", "Bir kitabı sildin.", "34.png", "silme", 1, 50),
     ]
 
     conn = get_connection()
     cursor = conn.cursor()
 
-    for name, desc, image, ttype, value in achievements_list:
-        try:
-            cursor.execute(
-                "INSERT INTO achievements (name, description, image, trigger_type, trigger_value) VALUES (?, ?, ?, ?, ?)",
-                (name, desc, image, ttype, value)
-            )
-        except sqlite3.IntegrityError:
-            continue
+    # Listede değişen kural/ödül varsa tablodaki satır güncellenir
+    changes_before = conn.total_changes
+    cursor.executemany("""
+        INSERT INTO achievements (name, description, image, trigger_type, trigger_value, xp_reward)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(name) DO UPDATE SET
+            description=excluded.description, image=excluded.image, trigger_type=excluded.trigger_type,
+            trigger_value=excluded.trigger_value, xp_reward=excluded.xp_reward
+        WHERE description IS NOT excluded.description OR image IS NOT excluded.image
+           OR trigger_type IS NOT excluded.trigger_type OR trigger_value IS NOT excluded.trigger_value
+           OR xp_reward IS NOT excluded.xp_reward
+    """, achievements_list)
 
     conn.commit()
+    if conn.total_changes != changes_before:
+        invalidate_catalog()
     conn.close()
     print("✅ Başarımlar eklendi.")
 
 
+# Başarım kataloğu sürümü; achievements tablosu değiştikçe artar ve
+# bellekteki kural kayıt defterinin (achievements.get_registry) yeniden derlenmesini sağlar
+catalog_version = 0
+
+def invalidate_catalog():
+    global catalog_version
+    catalog_version += 1
+
+
 # ------------------ add_xp ------------------
-def add_xp(user_id, amount, conn=None):
+# XP ledger'a (xp_events) bir satır yazar ve users.xp/level'ı tek bir atomik
+# UPDATE ile günceller. conn verildiyse commit çağıranındır.
+# Yeni (xp, level) değerini, kullanıcı yoksa None döndürür.
+def add_xp(user_id, amount, conn=None, reason=None):
     close_conn = False
     if conn is None:
         conn = get_connection()
         close_conn = True
 
     cursor = conn.cursor()
-    cursor.execute("SELECT xp, level FROM users WHERE id=?", (user_id,))
-    row = cursor.fetchone()
-    if not row:
-        if close_conn:
-            conn.close()
-        return
-
-    xp, level = row
-    xp += amount
-    new_level = (xp // 100) + 1
-    cursor.execute("UPDATE users SET xp=?, level=? WHERE id=?", (xp, new_level, user_id))
+    cursor.execute(
+        "UPDATE users SET xp = xp + ?, level = (xp + ?) / 100 + 1 WHERE id=? RETURNING xp, level",
+        (amount, amount, user_id)
+    )
+    rows = cursor.fetchall()
+    if rows:
+        # Kullanıcı kutusu önbelleği commit'ten sonra silinir: daha önce silinirse araya giren
+        # bir istek commit edilmemiş eski satırı okuyup yeniden önbelleğe koyabilirdi
+        conn.after_commit(lambda: invalidate_user_box(user_id))
+        cursor.execute(
+            "INSERT INTO xp_events (user_id, amount, reason) VALUES (?, ?, ?)",
+            (user_id, amount, reason)
+        )
 
     if close_conn:
         conn.commit()
         conn.close()
-    else:
-        conn.commit()
+    return rows[0] if rows else None
 
-# ------------------ check_achievements + XP ------------------
-def check_achievements(user_id, conn=None):
+# ------------------ recompute_xp ------------------
+# users.xp / level değerlerini ledger'dan yeniden hesaplar; düzeltilen kullanıcı sayısını döndürür
+def recompute_xp(conn=None):
     close_conn = False
     if conn is None:
         conn = get_connection()
         close_conn = True
+
     cursor = conn.cursor()
+    cursor.execute("""
+        UPDATE users
+        SET xp = t.total, level = t.total / 100 + 1
+        FROM (
+            SELECT u.id, COALESCE(SUM(e.amount), 0) AS total
+            FROM users u
+            LEFT JOIN xp_events e ON e.user_id = u.id
+            GROUP BY u.id
+        ) AS t
+        WHERE users.id = t.id AND (users.xp IS NOT t.total OR users.level IS NOT t.total / 100 + 1)
+    """)
+    fixed = cursor.rowcount
+    conn.commit()
+    if fixed:
+        invalidate_user_box()
 
-    # Kullanıcı verileri
-    cursor.execute("SELECT COUNT(*) FROM books WHERE user_id=?", (user_id,))
-    total_books = cursor.fetchone()[0]
-    cursor.execute("SELECT COUNT(DISTINCT book_id) FROM notes WHERE user_id=?", (user_id,))
-    total_notes = cursor.fetchone()[0]
-    cursor.execute("SELECT COUNT(*) FROM comments WHERE user_id=?", (user_id,))
-    total_comments = cursor.fetchone()[0]
-    cursor.execute("SELECT COUNT(*) FROM follows WHERE follower_id=?", (user_id,))
-    total_following = cursor.fetchone()[0]
-    cursor.execute("SELECT COUNT(*) FROM follows WHERE following_id=?", (user_id,))
-    total_followers = cursor.fetchone()[0]
-    cursor.execute("SELECT xp, level FROM users WHERE id=?", (user_id,))
-    xp, level = cursor.fetchone()
-    cursor.execute("SELECT SUM(page) FROM books WHERE user_id=?", (user_id,))
-    total_pages = cursor.fetchone()[0] or 0
-
-    # Achievements tablosu
-    cursor.execute("SELECT id, name, description, image, trigger_type, trigger_value FROM achievements")
-    all_achievements = cursor.fetchall()
-
-    # XP ödülleri
-    achievement_xp = {
-        "İlk Kitap!": 50,
-        "5 Kitap Okudun!": 100,
-        "10 Kitap Okudun!": 200,
-        "25 Kitap Okudun!": 300,
-        "50 Kitap Okudun!": 500,
-        "İlk Tamamlanan Kitap": 50,
-        "Haftanın Kitapçısı": 150,
-        "Ayın Kitapçısı": 250,
-        "Sayfa Maratoncusu": 100,
-        "Sayfa Maratoncusu II": 250,
-        "Sayfa Maratoncusu III": 500,
-        "Çok Okuyan Yazar": 100,
-        "Kitap Koleksiyoncusu": 150,
-        "İlk Not": 50,
-        "Not Tutkunu": 100,
-        "Detaycı": 200,
-        "Popüler Yorumcu": 100,
-        "İlk Takip": 50,
-        "Takipçi Kazan!": 50,
-        "Takipçi Ormanı": 150,
-        "Sosyal Kuş": 100,
-        "Süper Sosyal": 250,
-        "Ortak Zevk": 50,
-        "Kitap Arkadaşım": 100,
-        "Seviye 2’ye Hoşgeldin": 50,
-        "Seviye 5’e Hoşgeldin": 100,
-        "Seviye 10’a Hoşgeldin": 200,
-        "XP Canavarı": 50,
-        "XP Yıldızı": 100,
-        "XP Efsanesi": 200,
-        "Okuma Maratoncusu": 100,
-        "Ayın Maratoncusu": 250,
-        "Yorumcu Arkadaş": 50,
-        "Kitap Silici": 50
-    }
-
-    for ach_id, ach_name, ach_desc, ach_image, trigger_type, trigger_value in all_achievements:
-        cursor.execute("SELECT 1 FROM user_achievements WHERE user_id=? AND achievement_id=?", (user_id, ach_id))
-        if cursor.fetchone():
-            continue
-
-        unlocked = False
-
-        # 📌 Trigger kontrolleri
-        if trigger_type == "kitap_ekleme" and total_books >= trigger_value:
-            unlocked = True
-        elif trigger_type == "not_ekleme" and total_notes >= trigger_value:
-            unlocked = True
-        elif trigger_type == "yorum" and total_comments >= trigger_value:
-            unlocked = True
-        elif trigger_type == "takip" and total_following >= trigger_value:
-            unlocked = True
-        elif trigger_type == "takip_edilme" and total_followers >= trigger_value:
-            unlocked = True
-        elif trigger_type == "xp" and xp >= trigger_value:
-            unlocked = True
-        elif trigger_type == "level" and level >= trigger_value:
-            unlocked = True
-        elif trigger_type == "sayfa" and total_pages >= trigger_value:
-            unlocked = True
-        elif trigger_type == "haftalik_sayfa":
-            cursor.execute("""
-                SELECT SUM(page) FROM books 
-                WHERE user_id=? AND date(created_at) >= date('now','-7 day')
-            """, (user_id,))
-            weekly_pages = cursor.fetchone()[0] or 0
-            if weekly_pages >= trigger_value:
-                unlocked = True
-        elif trigger_type == "aylik_sayfa":
-            cursor.execute("""
-                SELECT SUM(page) FROM books 
-                WHERE user_id=? AND date(created_at) >= date('now','-1 month')
-            """, (user_id,))
-            monthly_pages = cursor.fetchone()[0] or 0
-            if monthly_pages >= trigger_value:
-                unlocked = True
-        elif trigger_type == "ortak_kitap":
-            cursor.execute("""
-                SELECT COUNT(*) 
-                FROM books b1 
-                JOIN books b2 ON b1.title = b2.title AND b1.user_id != b2.user_id
-                WHERE b1.user_id=?
-            """, (user_id,))
-            ortak = cursor.fetchone()[0] or 0
-            if ortak >= trigger_value:
-                unlocked = True
-        elif trigger_type == "silme":
-            cursor.execute("SELECT COUNT(*) FROM deleted_books WHERE user_id=?", (user_id,))
-            silinen = cursor.fetchone()[0] or 0
-            if silinen >= trigger_value:
-                unlocked = True
-
-        if unlocked:
-            cursor.execute(
-                "INSERT INTO user_achievements (user_id, achievement_id) VALUES (?, ?)",
-                (user_id, ach_id)
-            )
-            xp_to_add = achievement_xp.get(ach_name, 50)
-            add_xp(user_id, xp_to_add, conn)
-            print(f"[DEBUG] Açıldı: {ach_name}, +{xp_to_add} XP")
+    if close_conn:
+        conn.close()
+    return fixed
+
+# ------------------ add_wall_comment ------------------
+# Profil duvarı yorumları bir kitaba bağlı değildir: book_id NULL (migrasyon 19); commit çağıranındır
+def add_wall_comment(user_id, comment, conn):
+    conn.execute(
+        "INSERT INTO comments (book_id, user_id, comment) VALUES (NULL, ?, ?)",
+        (user_id, comment)
+    )
+
+# ------------------ user_stats ------------------
+# Sayaçlar books/notes/comments/follows/deleted_books tetikleyicileriyle güncel tutulur
+def get_user_stats(user_id, conn):
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT {', '.join(USER_STATS_COLUMNS)} FROM user_stats WHERE user_id=?", (user_id,))
+    row = cursor.fetchone() or (0,) * len(USER_STATS_COLUMNS)
+    return dict(zip(USER_STATS_COLUMNS, row))
+
+# Ham tablolarla uyuşmayan user_stats satırlarının user_id listesi
+def verify_user_stats(conn=None):
+    close_conn = False
+    if conn is None:
+        conn = get_connection()
+        close_conn = True
+
+    cols = ", ".join(USER_STATS_COLUMNS)
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT user_id FROM (
+            SELECT user_id, {cols} FROM ({USER_STATS_ACTUAL})
+            EXCEPT
+            SELECT user_id, {cols} FROM user_stats
+        )
+    """)
+    mismatched = [row[0] for row in cursor.fetchall()]
 
     if close_conn:
-        conn.commit()
         conn.close()
-    else:
-        conn.commit()
+    return mismatched
+
+def rebuild_user_stats(conn=None):
+    close_conn = False
+    if conn is None:
+        conn = get_connection()
+        close_conn = True
+
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM user_stats")
+    cursor.execute(f"INSERT INTO user_stats (user_id, {', '.join(USER_STATS_COLUMNS)}) {USER_STATS_ACTUAL}")
+    rebuilt = cursor.rowcount
+    conn.commit()
+
+    if close_conn:
+        conn.close()
+    return rebuilt
+
+
+# ------------------ works ------------------
+# Aynı eserin farklı yazımları (büyük/küçük harf, boşluk) tek bir works satırında toplanır
+def work_key(title, author):
+    return title.strip().lower(), author.strip().lower()
+
+def get_or_create_work(title, author, page, conn):
+    title_key, author_key = work_key(title, author)
+    cursor = conn.cursor()
+    cursor.execute("""
+        INSERT INTO works (title_key, author_key, title, author, page) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(title_key, author_key) DO UPDATE SET page = COALESCE(works.page, excluded.page)
+        RETURNING id
+    """, (title_key, author_key, title, author, page))
+    return cursor.fetchall()[0][0]
+
+
+# ------------------ Liderlik tablosu ------------------
+# Aylık anlık görüntü okuma ayına göre tutulur; eski aylar ve boşalan satırlar
+# 'flask prune-leaderboard' ile budanır (okuma yolu yazmaz).
+LEADERBOARD_KEEP_MONTHS = 12
+
+def leaderboard_month():
+    return datetime.now().strftime("%Y-%m")
+
+# Budanan satır sayısını döndürür
+def prune_leaderboard(keep_months=LEADERBOARD_KEEP_MONTHS, conn=None):
+    close_conn = False
+    if conn is None:
+        conn = get_connection()
+        close_conn = True
+
+    now = datetime.now()
+    year, mon = now.year, now.month - keep_months
+    while mon < 1:
+        year, mon = year - 1, mon + 12
+    pruned = conn.execute(
+        "DELETE FROM leaderboard_monthly WHERE month < ? OR books <= 0", (f"{year:04d}-{mon:02d}",)
+    ).rowcount
+    conn.commit()
+
+    if close_conn:
+        conn.close()
+    return pruned
+
+def rebuild_leaderboard(conn=None):
+    close_conn = False
+    if conn is None:
+        conn = get_connection()
+        close_conn = True
+
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM leaderboard_monthly")
+    cursor.execute("INSERT INTO leaderboard_monthly (month, user_id, books) " + LEADERBOARD_MONTHLY_ACTUAL)
+    rebuilt = cursor.rowcount
+    conn.commit()
+
+    if close_conn:
+        conn.close()
+    return rebuilt
+
+
+# ------------------ Timeline ------------------
+# Kitap eklenince/takip edilince tetikleyiciler timeline'a yazar (fan-out on write).
+# Kullanıcının feed'i okunurken TIMELINE_KEEP'ten eski satırlar budanır.
+def trim_timeline(user_id, conn):
+    # Fazlalık yoksa yazma kilidi hiç alınmaz
+    extra = conn.execute("""
+        SELECT 1 FROM timeline WHERE user_id = ?
+        ORDER BY created_at DESC, book_id DESC LIMIT 1 OFFSET ?
+    """, (user_id, TIMELINE_KEEP)).fetchone()
+    if extra is None:
+        return 0
+
+    cursor = conn.execute("""
+        DELETE FROM timeline WHERE user_id = ? AND (created_at, book_id) < (
+            SELECT created_at, book_id FROM timeline WHERE user_id = ?
+            ORDER BY created_at DESC, book_id DESC LIMIT 1 OFFSET ?
+        )
+    """, (user_id, user_id, TIMELINE_KEEP - 1))
+    return cursor.rowcount
+
+
+# ------------------ Konuşmalar ------------------
+# conversations satırı tetikleyiciyle mesaj eklenirken güncellenir; okununca sayaç sıfırlanır.
+def conversation_key(user_id, other_id):
+    return min(user_id, other_id), max(user_id, other_id)
+
+def mark_conversation_read(user_id, other_id, conn):
+    user_a, user_b = conversation_key(user_id, other_id)
+    side = "unread_a" if user_id == user_a else "unread_b"
+    cursor = conn.execute(
+        f"UPDATE conversations SET {side} = 0 WHERE user_a=? AND user_b=? AND {side} > 0",
+        (user_a, user_b)
+    )
+    return cursor.rowcount
+
+
+# ------------------ Veri sürümleri ------------------
+# data_versions sayaçlarını tetikleyiciler artırır (migrasyon 14); parça önbelleği
+# anahtarına eklenir, böylece yazmadan sonra eski parçalar hiçbir süreçte kullanılmaz.
+def data_versions(names, conn):
+    marks = ", ".join("?" for _ in names)
+    rows = dict(conn.execute(
+        f"SELECT name, version FROM data_versions WHERE name IN ({marks})", tuple(names)
+    ).fetchall())
+    return tuple(rows.get(name, 0) for name in names)
+
+
+# ------------------ Sohbet arşivi ------------------
+# CHAT_RETENTION_DAYS'ten eski sohbet mesajları ekli archive.db'ye taşınır; sıcak tablolar
+# küçük kalır, eski geçmiş istenince arşivden aynı id sırasıyla okunur.
+CHAT_RETENTION_DAYS = 30
+ARCHIVE_BATCH = 5000
+ARCHIVED_TABLES = ("general_chat", "private_messages")
+
+def init_archive(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS archive.general_chat (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            content TEXT NOT NULL,
+            created_at TIMESTAMP
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS archive.private_messages (
+            id INTEGER PRIMARY KEY,
+            sender_id INTEGER NOT NULL,
+            receiver_id INTEGER NOT NULL,
+            content TEXT NOT NULL,
+            created_at TIMESTAMP
+        )
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS archive.idx_archive_private_pair_id
+        ON private_messages(sender_id, receiver_id, id)
+    """)
+    conn.commit()
+
+# Mesajlar id sırasıyla (zamanla artar) ARCHIVE_BATCH'lik parçalar halinde taşınır.
+# Her parça önce arşive (id üzerinden tekrar güvenli) yazılır, sonra sıcak tablodan silinir.
+def archive_chat(days=CHAT_RETENTION_DAYS, conn=None):
+    close_conn = False
+    if conn is None:
+        conn = get_connection()
+        close_conn = True
+
+    cutoff = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+    moved = {}
+    for table in ARCHIVED_TABLES:
+        columns = ", ".join(
+            row[1] for row in conn.execute(f"PRAGMA archive.table_info({table})")
+        )
+        moved[table] = 0
+        while True:
+            rows = conn.execute(
+                f"SELECT id, created_at FROM main.{table} ORDER BY id LIMIT ?", (ARCHIVE_BATCH,)
+            ).fetchall()
+            # Yalnızca baştaki eski mesajlar alınır, ilk yeni mesajda durulur
+            old = []
+            for msg_id, created_at in rows:
+                if created_at is None or str(created_at) >= cutoff:
+                    break
+                old.append(msg_id)
+            if not old:
+                break
+            conn.execute(f"""
+                INSERT OR IGNORE INTO archive.{table} ({columns})
+                SELECT {columns} FROM main.{table} WHERE id BETWEEN ? AND ?
+            """, (old[0], old[-1]))
+            conn.execute(f"DELETE FROM main.{table} WHERE id BETWEEN ? AND ?", (old[0], old[-1]))
+            conn.commit()
+            moved[table] += len(old)
+            if len(old) < len(rows) or len(rows) < ARCHIVE_BATCH:
+                break
+
+    if close_conn:
+        conn.close()
+    return moved
 
 
 if __name__ == "__main__":
@@ -371,4 +651,5 @@ if __name__ == "__main__":
     conn.close()
 
     # Artık achievements kontrol edebilirsin
+    from achievements import check_achievements
     check_achievements(1)
\ No newline at end of file
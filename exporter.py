@@ -0,0 +1,109 @@
+import csv
+import json
+
+from database import get_connection
+
+# ------------------ Akışlı dışa aktarma ------------------
+# Satırlar cursor üzerinde dolaşılarak tek tek CSV / JSON Lines satırına çevrilip yield edilir;
+# hiçbir aşamada liste kurulmadığından bellek kullanımı kütüphane boyutundan bağımsızdır.
+# Üreteç kendi havuz bağlantısını açar: Flask akışı istek bittikten sonra da sürebilir.
+# Okuma tek bir SELECT olduğundan dışa aktarma tutarlı bir anlık görüntüdür (WAL).
+EXPORT_FORMATS = ("csv", "jsonl")
+EXPORT_MIMETYPES = {"csv": "text/csv", "jsonl": "application/x-ndjson"}
+
+# Kullanıcı dışa aktarımları: tür -> (sütunlar, sorgu). books çıktısı importer.py ile geri yüklenebilir.
+USER_EXPORTS = {
+    "books": (
+        ("title", "author", "page", "read_date", "notes", "created_at"),
+        """
+        SELECT b.title, b.author, b.page, b.read_date,
+               (SELECT group_concat(n.note, char(10)) FROM notes n
+                WHERE n.book_id = b.id AND n.user_id = b.user_id),
+               b.created_at
+        FROM books b
+        WHERE b.user_id = ?
+        ORDER BY b.id
+        """,
+    ),
+    "comments": (
+        ("book_title", "book_author", "comment", "created_at"),
+        # book_id NULL ise profil duvarı yorumudur, kitap alanları boş kalır
+        """
+        SELECT b.title, b.author, c.comment, c.created_at
+        FROM comments c
+        LEFT JOIN books b ON b.id = c.book_id
+        WHERE c.user_id = ?
+        ORDER BY c.id
+        """,
+    ),
+}
+
+# Yönetici (tüm veritabanı) dışa aktarımı: tablolar ve dışarıda bırakılan sütunlar.
+# Şema öneki olmayanlar main'dir; archive-chat ile taşınan eski mesajlar ekli archive.db'dedir.
+ADMIN_EXPORT_TABLES = (
+    "users", "works", "books", "notes", "comments", "follows", "deleted_books",
+    "achievements", "user_achievements", "xp_events", "general_chat", "private_messages",
+    "archive.general_chat", "archive.private_messages",
+)
+EXCLUDED_COLUMNS = {"users": ("password",)}
+
+
+# csv.writer satırı bir dosyaya yazmak yerine döndürsün diye
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def _serialize(rows, columns, fmt, header=True):
+    if fmt == "csv":
+        writer = csv.writer(_Echo())
+        if header:
+            yield writer.writerow(columns)
+        for row in rows:
+            yield writer.writerow(row)
+    else:
+        for row in rows:
+            yield json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n"
+
+
+def export_user(user_id, kind="books", fmt="csv", connect=get_connection):
+    columns, sql = USER_EXPORTS[kind]
+    conn = connect()
+    try:
+        yield from _serialize(conn.execute(sql, (user_id,)), columns, fmt)
+    finally:
+        conn.close()
+
+
+# "archive.general_chat" -> ("archive", "general_chat")
+def _split_table(name):
+    schema, _, table = name.rpartition(".")
+    return schema or "main", table
+
+
+def _table_columns(conn, schema, table):
+    excluded = EXCLUDED_COLUMNS.get(table, ())
+    return [row[1] for row in conn.execute(f"PRAGMA {schema}.table_info({table})") if row[1] not in excluded]
+
+
+# Tüm tablolar tek JSON Lines akışında: {"schema": ..., "table": ..., "row": {...}}. Tabloların hepsi
+# tek transaction içinde okunur, böylece aradaki yazmalar çıktıyı tutarsız yapmaz. WAL'da her
+# veritabanı dosyasının anlık görüntüsü ilk okumada alındığından tüm şemalar en başta okunur;
+# aksi halde araya giren bir archive-chat mesajları hem main'de hem arşivde gösterebilirdi.
+def export_database(tables=ADMIN_EXPORT_TABLES, connect=get_connection):
+    targets = [_split_table(name) for name in tables]
+    conn = connect()
+    try:
+        conn.execute("BEGIN")
+        for schema in dict.fromkeys(schema for schema, _ in targets):
+            conn.execute(f"SELECT 1 FROM {schema}.sqlite_master LIMIT 1").fetchall()
+        for schema, table in targets:
+            columns = _table_columns(conn, schema, table)
+            cursor = conn.execute(f"SELECT {', '.join(columns)} FROM {schema}.{table} ORDER BY rowid")
+            for row in cursor:
+                yield json.dumps(
+                    {"schema": schema, "table": table, "row": dict(zip(columns, row))}, ensure_ascii=False
+                ) + "\n"
+        conn.rollback()
+    finally:
+        conn.close()
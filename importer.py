@@ -0,0 +1,187 @@
+import csv
+import io
+import json
+from datetime import datetime
+
+from database import get_connection, add_xp, work_key
+from jobs import enqueue_achievements, enqueue_shared_titles
+
+# ------------------ Toplu kitap içe aktarma ------------------
+# CSV (bu uygulamanın sütunları ya da Goodreads dışa aktarımı), JSON dizisi veya JSON Lines
+# dosyası satır satır okunur. Kullanıcının mevcut (title, author) çiftleri tek sorguda
+# alınıp tekrarlar ayıklanır; kitaplar ve notlar IMPORT_CHUNK'lık parçalar halinde
+# executemany ile yazılır. Her parça, XP'si ve başarım işiyle birlikte tek transaction'dır;
+# dosyanın ortasında bir hata çıkarsa o satıra kadar okunanlar eksiksiz yazılmış olur.
+IMPORT_CHUNK = 500
+IMPORT_FORMATS = ("csv", "json", "jsonl")
+BOOK_XP = 10  # add_book ile aynı
+
+# Küçük harfe çevrilmiş sütun adı -> alan
+COLUMN_ALIASES = {
+    "title": "title", "kitap": "title", "kitap adı": "title",
+    "author": "author", "yazar": "author",
+    "page": "page", "pages": "page", "number of pages": "page", "sayfa": "page",
+    "read_date": "read_date", "date read": "read_date", "okuma tarihi": "read_date",
+    "notes": "note", "note": "note", "my review": "note", "private notes": "note", "not": "note",
+    "exclusive shelf": "shelf",
+}
+DATE_FORMATS = ("%Y-%m-%d", "%Y/%m/%d", "%d.%m.%Y")
+
+
+# Dosya okunurken çıkan hata; line hatalı satır (JSON dizisinde çözücünün bildirdiği satır),
+# result import_books'un hatadan önce yazdıklarıdır
+class BookImportError(ValueError):
+    def __init__(self, message, line=None):
+        super().__init__(message)
+        self.line = line
+        self.result = None
+
+
+def import_format(filename, fmt=None):
+    if fmt in IMPORT_FORMATS:
+        return fmt
+    ext = (filename or "").rsplit(".", 1)[-1].lower()
+    return ext if ext in IMPORT_FORMATS else "csv"
+
+
+def _parse_date(value):
+    value = (value or "").strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).strftime("%Y-%m-%d")
+        except ValueError:
+            continue
+    return None
+
+
+def _parse_page(value):
+    value = str(value or "").strip()
+    return int(value) if value.isdigit() and int(value) > 0 else None
+
+
+# Ham kaydı alanlara eşler; başlık/yazar yoksa None (geçersiz satır)
+def _normalize(record):
+    fields = {}
+    for key, value in record.items():
+        field = COLUMN_ALIASES.get(str(key).strip().lower())
+        if field and field not in fields:
+            fields[field] = value
+    title = str(fields.get("title") or "").strip()
+    author = str(fields.get("author") or "").strip()
+    if not title or not author:
+        return None
+    note = str(fields.get("note") or "").strip()
+    return {
+        "title": title,
+        "author": author,
+        "page": _parse_page(fields.get("page")),
+        "read_date": _parse_date(fields.get("read_date")),
+        "note": note or None,
+        "shelf": str(fields.get("shelf") or "").strip().lower() or None,
+    }
+
+
+# Dosyadaki kayıtları sırayla üretir; binary akış verilirse UTF-8 (BOM'lu olabilir) okunur.
+# JSON dizisi bütün olarak çözülür, büyük dosyalar için JSON Lines tercih edilmeli.
+# Okuma hatası BookImportError olarak hatalı satır numarasıyla yükseltilir.
+def parse_books(stream, fmt="csv"):
+    if not isinstance(stream, io.TextIOBase):
+        stream = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    line = 0  # son eksiksiz okunan satır
+    try:
+        if fmt == "csv":
+            reader = csv.DictReader(stream)
+            for record in reader:
+                line = reader.line_num
+                yield _normalize(record)
+        elif fmt == "jsonl":
+            for text in stream:
+                if text.strip():
+                    record = json.loads(text)
+                    yield _normalize(record) if isinstance(record, dict) else None
+                line += 1
+        else:
+            data = json.load(stream)
+            records = data.get("books", []) if isinstance(data, dict) else data
+            for record in records:
+                yield _normalize(record) if isinstance(record, dict) else None
+    except json.JSONDecodeError as e:
+        raise BookImportError(e.msg, e.lineno if fmt == "json" else line + 1) from e
+    except (ValueError, csv.Error) as e:
+        raise BookImportError(str(e), line + 1) from e
+
+
+# Bir parçayı yazar: kitaplar, notlar, XP ve başarım işleri aynı transaction'da commit edilir
+def _write_chunk(user_id, chunk, existing, result, conn):
+    cursor = conn.cursor()
+    new_books = []
+    for book in chunk:
+        if book is None:
+            result["invalid"] += 1
+        elif book["shelf"] not in (None, "read"):
+            # Goodreads'te okunmamış raflar (to-read, currently-reading) alınmaz
+            result["unread"] += 1
+        elif (book["title"], book["author"]) in existing:
+            result["duplicates"] += 1
+        else:
+            existing.add((book["title"], book["author"]))
+            new_books.append(book)
+    if not new_books:
+        return
+
+    keys = [work_key(b["title"], b["author"]) for b in new_books]
+    cursor.executemany("""
+        INSERT INTO works (title_key, author_key, title, author, page) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(title_key, author_key) DO UPDATE SET page = COALESCE(works.page, excluded.page)
+    """, [(*key, b["title"], b["author"], b["page"]) for key, b in zip(keys, new_books)])
+    cursor.executemany("""
+        INSERT INTO books (user_id, title, author, page, read_date, work_id)
+        VALUES (?, ?, ?, ?, ?, (SELECT id FROM works WHERE title_key=? AND author_key=?))
+    """, [(user_id, b["title"], b["author"], b["page"], b["read_date"], *key)
+          for key, b in zip(keys, new_books)])
+
+    notes = [(user_id, b["note"], user_id, b["title"], b["author"]) for b in new_books if b["note"]]
+    if notes:
+        # +user_id: planlayıcı (user_id, author) yerine seçici (title, author) indeksini kullansın;
+        # aksi halde her not için kullanıcının o yazardaki tüm kitapları taranır
+        cursor.executemany("""
+            INSERT INTO notes (book_id, user_id, note)
+            SELECT id, ?, ? FROM books WHERE +user_id=? AND title=? AND author=?
+        """, notes)
+
+    # XP ve başarım işi parçayla birlikte; değerlendirme iş kuyruğunda yapılır
+    add_xp(user_id, BOOK_XP * len(new_books), conn, reason="kitap_ekleme")
+    enqueue_achievements(user_id, ["book_added"] + (["note_added"] if notes else []), conn)
+    enqueue_shared_titles(user_id, {b["title"] for b in new_books}, conn)
+    conn.commit()
+    result["added"] += len(new_books)
+    result["notes"] += len(notes)
+
+
+def import_books(user_id, books, conn=None, chunk_size=IMPORT_CHUNK):
+    close_conn = False
+    if conn is None:
+        conn = get_connection()
+        close_conn = True
+
+    result = {"added": 0, "notes": 0, "duplicates": 0, "unread": 0, "invalid": 0}
+    existing = set(conn.execute("SELECT title, author FROM books WHERE user_id=?", (user_id,)).fetchall())
+
+    try:
+        chunk = []
+        try:
+            for book in books:
+                chunk.append(book)
+                if len(chunk) >= chunk_size:
+                    _write_chunk(user_id, chunk, existing, result, conn)
+                    chunk = []
+        except BookImportError as e:
+            # Hatalı satıra kadar okunanlar yazılır; çağıran kaçının eklendiğini e.result'tan görür
+            _write_chunk(user_id, chunk, existing, result, conn)
+            e.result = result
+            raise
+        _write_chunk(user_id, chunk, existing, result, conn)
+    finally:
+        if close_conn:
+            conn.close()
+    return result
@@ -0,0 +1,145 @@
+import os
+import threading
+
+from achievements import check_achievements, get_registry
+from database import get_connection
+from migrations import JOB_MAX_ATTEMPTS
+
+# ------------------ Başarım iş kuyruğu ------------------
+# Yazma route'ları "kullanıcı X şunu yaptı" olayını isteğin kendi transaction'ında
+# achievement_jobs tablosuna yazar ve hemen döner; değerlendirmeyi arka plandaki worker yapar.
+# (user_id, event) tekil olduğundan aynı kullanıcının bekleyen olayları tek işte birleşir;
+# JOB_MAX_ATTEMPTS kez başarısız olmuş bir iş aynı olay yeniden gelince sıfırlanıp tekrar denenir.
+# Her süreçte tek worker thread vardır (SQLite'ta tek yazıcı); iş BEGIN IMMEDIATE altında
+# alınıp aynı transaction'da silindiği için birden fazla süreç aynı işi iki kez işlemez.
+ALL_EVENTS = "*"            # events=None: tüm kurallar
+JOB_POLL_INTERVAL = 1.0     # saniye; başka süreçlerin yazdığı işler için
+SHARED_TITLE_EVENT = "shared_title:"   # + başlık; başlığın okurlarına yayma worker'da yapılır
+
+
+# events=None tüm kuralların değerlendirilmesini ister; commit çağıranındır
+def enqueue_achievements(user_id, events, conn):
+    conn.executemany(
+        "INSERT INTO achievement_jobs (user_id, event) VALUES (?, ?) "
+        "ON CONFLICT(user_id, event) DO UPDATE SET attempts = 0",
+        [(user_id, event) for event in (events if events is not None else [ALL_EVENTS])]
+    )
+
+
+# Eklenen başlıkları okumuş diğer kullanıcıların ortak_kitap sayısı da artar. Yazma yolunda
+# başlık başına tek iş yazılır (okur sayısından bağımsız); okurlara yayma worker'dadır.
+# commit çağıranındır.
+def enqueue_shared_titles(user_id, titles, conn):
+    enqueue_achievements(user_id, [SHARED_TITLE_EVENT + title for title in titles], conn)
+
+
+# Başlığın diğer okurlarından ortak_kitap kurallarından biri hâlâ kilitli olanlara shared_book işi yazar
+def _fan_out_shared_titles(user_id, titles, conn):
+    rule_ids = [rule.id for rule in get_registry(conn).by_trigger.get("ortak_kitap", ())]
+    if not titles or not rule_ids:
+        return
+    marks = ", ".join("?" for _ in rule_ids)
+    conn.executemany(f"""
+        INSERT INTO achievement_jobs (user_id, event)
+        SELECT DISTINCT b.user_id, 'shared_book' FROM books b
+        WHERE b.title = ? AND b.user_id != ?
+          AND (SELECT COUNT(*) FROM user_achievements ua
+               WHERE ua.user_id = b.user_id AND ua.achievement_id IN ({marks})) < ?
+        ON CONFLICT(user_id, event) DO UPDATE SET attempts = 0
+    """, [(title, user_id, *rule_ids, len(rule_ids)) for title in titles])
+
+
+def pending_achievement_jobs(user_id, conn):
+    row = conn.execute(
+        "SELECT 1 FROM achievement_jobs WHERE user_id=? AND attempts < ? LIMIT 1",
+        (user_id, JOB_MAX_ATTEMPTS)
+    ).fetchone()
+    return row is not None
+
+
+class AchievementWorker:
+    def __init__(self, connect=get_connection, poll_interval=JOB_POLL_INTERVAL):
+        self._connect = connect
+        self.poll_interval = poll_interval
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_thread(self):
+        # Fork sonrası (ya da ilk kullanımda) worker thread bu süreçte başlatılır
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid != os.getpid() or not self._thread.is_alive():
+                self._wake = threading.Event()
+                self._thread = threading.Thread(target=self._run, name="achievement-worker", daemon=True)
+                self._pid = os.getpid()
+                self._thread.start()
+
+    def start(self):
+        self._ensure_thread()
+
+    # İşi yazan transaction commit edildikten sonra çağrılır
+    def notify(self):
+        self._ensure_thread()
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            try:
+                self.drain()
+            except Exception as e:
+                print(f"⚠️ Başarım işi başarısız: {e}")
+
+    # Kuyruk boşalana kadar işler; işlenen kullanıcı sayısını döndürür
+    def drain(self):
+        done = 0
+        while self.run_once():
+            done += 1
+        return done
+
+    # En eski işin kullanıcısının tüm bekleyen olaylarını tek seferde değerlendirir
+    def run_once(self):
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            # Koşul sabit yazılır ki idx_achievement_jobs_ready kısmi indeksi kullanılsın
+            row = conn.execute(
+                f"SELECT user_id FROM achievement_jobs WHERE attempts < {JOB_MAX_ATTEMPTS} ORDER BY id LIMIT 1"
+            ).fetchone()
+            if row is None:
+                conn.rollback()
+                return False
+
+            user_id = row[0]
+            # Denemesi tükenmiş işler partiye girmez
+            jobs = conn.execute(
+                f"SELECT id, event FROM achievement_jobs WHERE user_id=? AND attempts < {JOB_MAX_ATTEMPTS}",
+                (user_id,)
+            ).fetchall()
+            events = [event for _, event in jobs if not event.startswith(SHARED_TITLE_EVENT)]
+            titles = [event[len(SHARED_TITLE_EVENT):] for _, event in jobs if event.startswith(SHARED_TITLE_EVENT)]
+            job_ids = [job_id for job_id, _ in jobs]
+            marks = ", ".join("?" for _ in jobs)
+            try:
+                if events:
+                    check_achievements(user_id, conn=conn, events=None if ALL_EVENTS in events else events)
+                _fan_out_shared_titles(user_id, titles, conn)
+                conn.execute(f"DELETE FROM achievement_jobs WHERE id IN ({marks})", job_ids)
+                conn.commit()
+            except Exception:
+                # Yalnızca bu partideki işlerin denemesi artar; JOB_MAX_ATTEMPTS denemeden sonra
+                # iş incelenmek üzere tabloda kalır (aynı olay yeniden gelene kadar)
+                conn.rollback()
+                conn.execute(f"UPDATE achievement_jobs SET attempts = attempts + 1 WHERE id IN ({marks})", job_ids)
+                conn.commit()
+                raise
+            return True
+        finally:
+            conn.close()
+
+
+achievement_worker = AchievementWorker()
@@ -0,0 +1,860 @@
+import re
+
+# ------------------ Şema migrasyonları ------------------
+# init_db() temel tabloları CREATE TABLE IF NOT EXISTS ile kurar (sürüm 0).
+# Sonraki her şema değişikliği buraya sıralı bir adım olarak eklenir ve
+# schema_version tablosuna işlenir. Bir adım ya SQL listesi ya da conn alan
+# bir fonksiyondur; her adım kendi transaction'ı içinde uygulanır.
+
+# user_stats'ın ham tablolardan hesaplanmış hali; rebuild/verify ve migrasyon kullanır.
+# Sütun sırası user_stats tablosuyla aynıdır.
+USER_STATS_ACTUAL = """
+    SELECT u.id AS user_id,
+           (SELECT COUNT(*) FROM books WHERE user_id = u.id) AS book_count,
+           (SELECT COALESCE(SUM(page), 0) FROM books WHERE user_id = u.id) AS page_total,
+           (SELECT COUNT(DISTINCT book_id) FROM notes WHERE user_id = u.id) AS notes_count,
+           (SELECT COUNT(*) FROM comments WHERE user_id = u.id) AS comments_count,
+           (SELECT COUNT(*) FROM follows WHERE following_id = u.id) AS followers,
+           (SELECT COUNT(*) FROM follows WHERE follower_id = u.id) AS following,
+           (SELECT COUNT(*) FROM deleted_books WHERE user_id = u.id) AS deleted_count,
+           (SELECT COUNT(DISTINCT author) FROM books WHERE user_id = u.id) AS distinct_authors
+    FROM users u
+"""
+
+# read_date 'YYYY-MM...' biçimindeyse okuma ayı ilk 7 karakterdir
+READ_MONTH_GLOB = "[0-9][0-9][0-9][0-9]-[0-9][0-9]*"
+
+LEADERBOARD_MONTHLY_ACTUAL = f"""
+    SELECT substr(read_date, 1, 7), user_id, COUNT(*)
+    FROM books
+    WHERE read_date GLOB '{READ_MONTH_GLOB}'
+    GROUP BY substr(read_date, 1, 7), user_id
+"""
+
+# Kullanıcı başına timeline'da tutulan en fazla kayıt; takipte geriye dönük doldurma da bununla sınırlı
+TIMELINE_KEEP = 500
+# Bu kadar denemede başarısız olan başarım işi kuyrukta bekletilir (jobs.py)
+JOB_MAX_ATTEMPTS = 3
+
+
+def _create_works(conn):
+    # Anahtar Python'da normalize edilir (SQLite lower() yalnızca ASCII'yi küçültür)
+    from database import get_or_create_work
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS works (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title_key TEXT NOT NULL,
+            author_key TEXT NOT NULL,
+            title TEXT NOT NULL,
+            author TEXT NOT NULL,
+            page INTEGER,
+            reader_count INTEGER NOT NULL DEFAULT 0,
+            UNIQUE(title_key, author_key)
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_works_title ON works(title, id)")
+    conn.execute("ALTER TABLE books ADD COLUMN work_id INTEGER REFERENCES works(id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_books_work_user ON books(work_id, user_id)")
+
+    # reader_count: esere sahip farklı kullanıcı sayısı; okuru kalmayan eser silinir
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS books_works_insert AFTER INSERT ON books
+        WHEN NEW.work_id IS NOT NULL BEGIN
+            UPDATE works
+            SET reader_count = reader_count
+                + ((SELECT COUNT(*) FROM books WHERE work_id = NEW.work_id AND user_id = NEW.user_id) = 1)
+            WHERE id = NEW.work_id;
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS books_works_delete AFTER DELETE ON books
+        WHEN OLD.work_id IS NOT NULL BEGIN
+            UPDATE works
+            SET reader_count = reader_count
+                - NOT EXISTS (SELECT 1 FROM books WHERE work_id = OLD.work_id AND user_id = OLD.user_id)
+            WHERE id = OLD.work_id;
+            DELETE FROM works WHERE id = OLD.work_id AND reader_count <= 0;
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS books_works_update AFTER UPDATE OF work_id, user_id ON books
+        WHEN OLD.work_id IS NOT NEW.work_id OR OLD.user_id IS NOT NEW.user_id BEGIN
+            UPDATE works
+            SET reader_count = reader_count
+                - NOT EXISTS (SELECT 1 FROM books WHERE work_id = OLD.work_id AND user_id = OLD.user_id)
+            WHERE id = OLD.work_id;
+            DELETE FROM works WHERE id = OLD.work_id AND reader_count <= 0;
+            UPDATE works
+            SET reader_count = reader_count
+                + ((SELECT COUNT(*) FROM books WHERE work_id = NEW.work_id AND user_id = NEW.user_id) = 1)
+            WHERE id = NEW.work_id;
+        END
+    """)
+
+    # Mevcut kitaplar: kütüphanedeki gibi başlık sırasıyla ilk görülen satır eserin adını verir
+    rows = conn.execute("SELECT id, title, author, page FROM books ORDER BY title ASC").fetchall()
+    conn.executemany(
+        "UPDATE books SET work_id=? WHERE id=?",
+        [(get_or_create_work(title, author, page, conn), book_id) for book_id, title, author, page in rows]
+    )
+
+
+# FTS5 dizinleri (external content): kaynak tablo, rowid sütunu, dizinlenen sütunlar
+FTS_TABLES = {
+    "books_fts": ("books", ("title", "author")),
+    "notes_fts": ("notes", ("note",)),
+    "comments_fts": ("comments", ("comment",)),
+}
+FTS_TOKENIZER = "unicode61 remove_diacritics 2"
+
+
+def _create_fts(conn):
+    for fts, (table, columns) in FTS_TABLES.items():
+        cols = ", ".join(columns)
+        new_cols = ", ".join(f"NEW.{c}" for c in columns)
+        old_cols = ", ".join(f"OLD.{c}" for c in columns)
+        conn.execute(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+                {cols}, content='{table}', content_rowid='id', tokenize='{FTS_TOKENIZER}'
+            )
+        """)
+        # Kaynak tabloyla eşzamanlı tutulur; silme/güncellemede eski içerik 'delete' ile çıkarılır
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_fts_insert AFTER INSERT ON {table} BEGIN
+                INSERT INTO {fts} (rowid, {cols}) VALUES (NEW.id, {new_cols});
+            END
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_fts_delete AFTER DELETE ON {table} BEGIN
+                INSERT INTO {fts} ({fts}, rowid, {cols}) VALUES ('delete', OLD.id, {old_cols});
+            END
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_fts_update AFTER UPDATE OF {cols} ON {table} BEGIN
+                INSERT INTO {fts} ({fts}, rowid, {cols}) VALUES ('delete', OLD.id, {old_cols});
+                INSERT INTO {fts} (rowid, {cols}) VALUES (NEW.id, {new_cols});
+            END
+        """)
+        conn.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+
+
+# Parça önbelleği sürümleri: izlenen tabloya her yazma ilgili sayacı artırır.
+# (sürüm adı, tablo, tetikleyici olayları)
+DATA_VERSION_SOURCES = (
+    ("books", "books", ("INSERT", "DELETE", "UPDATE")),
+    ("notes", "notes", ("INSERT", "DELETE", "UPDATE")),
+    ("users", "users", ("DELETE", "UPDATE OF xp, level, username")),
+)
+
+
+def _create_data_versions(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS data_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    """)
+    for name, table, events in DATA_VERSION_SOURCES:
+        conn.execute("INSERT OR IGNORE INTO data_versions (name) VALUES (?)", (name,))
+        for event in events:
+            suffix = event.split()[0].lower()
+            conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {table}_version_{suffix} AFTER {event} ON {table} BEGIN
+                    UPDATE data_versions SET version = version + 1 WHERE name = '{name}';
+                END
+            """)
+
+
+# comments.book_id NULL olabilsin: profil duvarı yorumları (eskiden book_id=0) FK kontrolünü
+# kapatmadan yazılabilsin. SQLite sütun kısıtını ALTER ile değiştiremediğinden tablo yeniden
+# kurulur; tablodaki indeks ve tetikleyiciler (FTS, sayaçlar) sqlite_master'dan alınıp geri yüklenir.
+def _nullable_comment_book(conn):
+    objects = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE tbl_name = 'comments' AND type IN ('index', 'trigger') AND sql IS NOT NULL"
+    ).fetchall()
+    seq = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'comments'").fetchone()
+    conn.execute("""
+        CREATE TABLE comments_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            book_id INTEGER,
+            user_id INTEGER NOT NULL,
+            comment TEXT NOT NULL,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(book_id) REFERENCES books(id) ON DELETE CASCADE,
+            FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    """)
+    # Artık kitabı olmayan yorumlar (FK açılmadan önce kalmış olabilir) taşınmaz
+    conn.execute("""
+        INSERT INTO comments_new (id, book_id, user_id, comment, created_at)
+        SELECT id, NULLIF(book_id, 0), user_id, comment, created_at FROM comments
+        WHERE (book_id = 0 OR book_id IN (SELECT id FROM books))
+          AND user_id IN (SELECT id FROM users)
+    """)
+    conn.execute("DROP TABLE comments")
+    conn.execute("ALTER TABLE comments_new RENAME TO comments")
+    if seq is not None:
+        # Silinmiş yorumların id'leri yeniden verilmesin (FTS rowid'leri de bunlara bağlı)
+        conn.execute("DELETE FROM sqlite_sequence WHERE name = 'comments'")
+        conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('comments', ?)", (seq[0],))
+    for (sql,) in objects:
+        conn.execute(sql)
+    conn.execute("""
+        UPDATE user_stats
+        SET comments_count = (SELECT COUNT(*) FROM comments WHERE user_id = user_stats.user_id)
+    """)
+    conn.execute("INSERT INTO comments_fts (comments_fts) VALUES ('rebuild')")
+
+
+MIGRATIONS = [
+    (1, "ikincil indeksler", [
+        # user_id tek başına sorgular da bu indeksin önekini kullanır
+        "CREATE INDEX IF NOT EXISTS idx_books_user_read_date ON books(user_id, read_date)",
+        "CREATE INDEX IF NOT EXISTS idx_books_title_author ON books(title, author)",
+        "CREATE INDEX IF NOT EXISTS idx_notes_book_user ON notes(book_id, user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_notes_user_book ON notes(user_id, book_id)",
+        "CREATE INDEX IF NOT EXISTS idx_comments_book ON comments(book_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_comments_user ON comments(user_id)",
+        # follows(follower_id, ...) UNIQUE kısıtının indeksiyle zaten karşılanıyor
+        "CREATE INDEX IF NOT EXISTS idx_follows_following ON follows(following_id, follower_id)",
+        "CREATE INDEX IF NOT EXISTS idx_pm_sender_receiver ON private_messages(sender_id, receiver_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_pm_receiver ON private_messages(receiver_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_general_chat_created ON general_chat(created_at)",
+        # user_achievements(user_id, ...) UNIQUE kısıtının indeksiyle zaten karşılanıyor
+        "CREATE INDEX IF NOT EXISTS idx_deleted_books_user ON deleted_books(user_id)",
+    ]),
+    (2, "başarım sayaçları (user_stats)", [
+        """
+        CREATE TABLE IF NOT EXISTS user_stats (
+            user_id INTEGER PRIMARY KEY,
+            book_count INTEGER NOT NULL DEFAULT 0,
+            page_total INTEGER NOT NULL DEFAULT 0,
+            notes_count INTEGER NOT NULL DEFAULT 0,     -- not eklenmiş farklı kitap sayısı
+            comments_count INTEGER NOT NULL DEFAULT 0,
+            followers INTEGER NOT NULL DEFAULT 0,
+            following INTEGER NOT NULL DEFAULT 0,
+            deleted_count INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+        """,
+        """
+        INSERT OR REPLACE INTO user_stats
+            (user_id, book_count, page_total, notes_count, comments_count, followers, following, deleted_count)
+        SELECT u.id,
+               (SELECT COUNT(*) FROM books WHERE user_id = u.id),
+               (SELECT COALESCE(SUM(page), 0) FROM books WHERE user_id = u.id),
+               (SELECT COUNT(DISTINCT book_id) FROM notes WHERE user_id = u.id),
+               (SELECT COUNT(*) FROM comments WHERE user_id = u.id),
+               (SELECT COUNT(*) FROM follows WHERE following_id = u.id),
+               (SELECT COUNT(*) FROM follows WHERE follower_id = u.id),
+               (SELECT COUNT(*) FROM deleted_books WHERE user_id = u.id)
+        FROM users u
+        """,
+        # haftalık / aylık sayfa pencereleri için
+        "CREATE INDEX IF NOT EXISTS idx_books_user_created ON books(user_id, created_at)",
+    ]),
+    (3, "başarım XP ödülleri katalogda", [
+        # Gerçek değerler açılışta insert_achievements() ile yazılır
+        "ALTER TABLE achievements ADD COLUMN xp_reward INTEGER NOT NULL DEFAULT 50",
+    ]),
+    (4, "XP ledger (xp_events)", [
+        """
+        CREATE TABLE IF NOT EXISTS xp_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            amount INTEGER NOT NULL,
+            reason TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_xp_events_user ON xp_events(user_id, amount)",
+        # Mevcut XP bakiyeleri ledger'ın açılış kaydı olur
+        "INSERT INTO xp_events (user_id, amount, reason) SELECT id, xp, 'acilis_bakiyesi' FROM users WHERE xp != 0",
+    ]),
+    (5, "user_stats tetikleyicileri", [
+        "ALTER TABLE user_stats ADD COLUMN distinct_authors INTEGER NOT NULL DEFAULT 0",
+        "CREATE INDEX IF NOT EXISTS idx_books_user_author ON books(user_id, author)",
+        """
+        CREATE TRIGGER IF NOT EXISTS users_stats_insert AFTER INSERT ON users BEGIN
+            INSERT OR IGNORE INTO user_stats (user_id) VALUES (NEW.id);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS books_stats_insert AFTER INSERT ON books BEGIN
+            INSERT OR IGNORE INTO user_stats (user_id) VALUES (NEW.user_id);
+            UPDATE user_stats
+            SET book_count = book_count + 1,
+                page_total = page_total + COALESCE(NEW.page, 0),
+                distinct_authors = distinct_authors
+                    + ((SELECT COUNT(*) FROM books WHERE user_id = NEW.user_id AND author = NEW.author) = 1)
+            WHERE user_id = NEW.user_id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS books_stats_delete AFTER DELETE ON books BEGIN
+            UPDATE user_stats
+            SET book_count = book_count - 1,
+                page_total = page_total - COALESCE(OLD.page, 0),
+                distinct_authors = distinct_authors
+                    - NOT EXISTS (SELECT 1 FROM books WHERE user_id = OLD.user_id AND author = OLD.author)
+            WHERE user_id = OLD.user_id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS books_stats_update AFTER UPDATE OF page, user_id ON books BEGIN
+            INSERT OR IGNORE INTO user_stats (user_id) VALUES (NEW.user_id);
+            UPDATE user_stats SET book_count = book_count - 1, page_total = page_total - COALESCE(OLD.page, 0)
+            WHERE user_id = OLD.user_id;
+            UPDATE user_stats SET book_count = book_count + 1, page_total = page_total + COALESCE(NEW.page, 0)
+            WHERE user_id = NEW.user_id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS books_stats_update_author AFTER UPDATE OF author, user_id ON books
+        WHEN OLD.author IS NOT NEW.author OR OLD.user_id IS NOT NEW.user_id BEGIN
+            INSERT OR IGNORE INTO user_stats (user_id) VALUES (NEW.user_id);
+            UPDATE user_stats
+            SET distinct_authors = distinct_authors
+                - NOT EXISTS (SELECT 1 FROM books WHERE user_id = OLD.user_id AND author = OLD.author)
+            WHERE user_id = OLD.user_id;
+            UPDATE user_stats
+            SET distinct_authors = distinct_authors
+                + ((SELECT COUNT(*) FROM books WHERE user_id = NEW.user_id AND author = NEW.author) = 1)
+            WHERE user_id = NEW.user_id;
+        END
+        """,
+        # notes_count: not eklenmiş farklı kitap sayısı
+        """
+        CREATE TRIGGER IF NOT EXISTS notes_stats_insert AFTER INSERT ON notes BEGIN
+            INSERT OR IGNORE INTO user_stats (user_id) VALUES (NEW.user_id);
+            UPDATE user_stats
+            SET notes_count = notes_count
+                + ((SELECT COUNT(*) FROM notes WHERE book_id = NEW.book_id AND user_id = NEW.user_id) = 1)
+            WHERE user_id = NEW.user_id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS notes_stats_delete AFTER DELETE ON notes BEGIN
+            UPDATE user_stats
+            SET notes_count = notes_count
+                - NOT EXISTS (SELECT 1 FROM notes WHERE book_id = OLD.book_id AND user_id = OLD.user_id)
+            WHERE user_id = OLD.user_id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS notes_stats_update AFTER UPDATE OF book_id, user_id ON notes
+        WHEN OLD.book_id IS NOT NEW.book_id OR OLD.user_id IS NOT NEW.user_id BEGIN
+            INSERT OR IGNORE INTO user_stats (user_id) VALUES (NEW.user_id);
+            UPDATE user_stats
+            SET notes_count = notes_count
+                - NOT EXISTS (SELECT 1 FROM notes WHERE book_id = OLD.book_id AND user_id = OLD.user_id)
+            WHERE user_id = OLD.user_id;
+            UPDATE user_stats
+            SET notes_count = notes_count
+                + ((SELECT COUNT(*) FROM notes WHERE book_id = NEW.book_id AND user_id = NEW.user_id) = 1)
+            WHERE user_id = NEW.user_id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS comments_stats_insert AFTER INSERT ON comments BEGIN
+            INSERT OR IGNORE INTO user_stats (user_id) VALUES (NEW.user_id);
+            UPDATE user_stats SET comments_count = comments_count + 1 WHERE user_id = NEW.user_id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS comments_stats_delete AFTER DELETE ON comments BEGIN
+            UPDATE user_stats SET comments_count = comments_count - 1 WHERE user_id = OLD.user_id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS follows_stats_insert AFTER INSERT ON follows BEGIN
+            INSERT OR IGNORE INTO user_stats (user_id) VALUES (NEW.follower_id);
+            INSERT OR IGNORE INTO user_stats (user_id) VALUES (NEW.following_id);
+            UPDATE user_stats SET following = following + 1 WHERE user_id = NEW.follower_id;
+            UPDATE user_stats SET followers = followers + 1 WHERE user_id = NEW.following_id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS follows_stats_delete AFTER DELETE ON follows BEGIN
+            UPDATE user_stats SET following = following - 1 WHERE user_id = OLD.follower_id;
+            UPDATE user_stats SET followers = followers - 1 WHERE user_id = OLD.following_id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS deleted_books_stats_insert AFTER INSERT ON deleted_books BEGIN
+            INSERT OR IGNORE INTO user_stats (user_id) VALUES (NEW.user_id);
+            UPDATE user_stats SET deleted_count = deleted_count + 1 WHERE user_id = NEW.user_id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS deleted_books_stats_delete AFTER DELETE ON deleted_books BEGIN
+            UPDATE user_stats SET deleted_count = deleted_count - 1 WHERE user_id = OLD.user_id;
+        END
+        """,
+        # Tetikleyiciler öncesi sayaçlar (ve yeni distinct_authors) ham tablolardan yeniden kurulur
+        "DELETE FROM user_stats",
+        "INSERT INTO user_stats " + USER_STATS_ACTUAL,
+    ]),
+    (6, "liderlik tablosu anlık görüntüleri", [
+        # Tüm zamanlar: user_stats / users üzerinde sıralı indeksler
+        "CREATE INDEX IF NOT EXISTS idx_user_stats_books ON user_stats(book_count DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_user_stats_pages ON user_stats(page_total DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_users_xp ON users(xp DESC)",
+        # Aylık: okuma ayı (read_date'in YYYY-MM kısmı) başına kullanıcı kitap sayısı
+        """
+        CREATE TABLE IF NOT EXISTS leaderboard_monthly (
+            month TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            books INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY(month, user_id),
+            FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_leaderboard_monthly_rank ON leaderboard_monthly(month, books DESC)",
+        f"""
+        CREATE TRIGGER IF NOT EXISTS books_monthly_insert AFTER INSERT ON books
+        WHEN NEW.read_date GLOB '{READ_MONTH_GLOB}' BEGIN
+            INSERT INTO leaderboard_monthly (month, user_id, books) VALUES (substr(NEW.read_date, 1, 7), NEW.user_id, 1)
+            ON CONFLICT(month, user_id) DO UPDATE SET books = books + 1;
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS books_monthly_delete AFTER DELETE ON books
+        WHEN OLD.read_date GLOB '{READ_MONTH_GLOB}' BEGIN
+            UPDATE leaderboard_monthly SET books = books - 1
+            WHERE month = substr(OLD.read_date, 1, 7) AND user_id = OLD.user_id;
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS books_monthly_update_old AFTER UPDATE OF read_date, user_id ON books
+        WHEN OLD.read_date GLOB '{READ_MONTH_GLOB}'
+         AND (OLD.read_date IS NOT NEW.read_date OR OLD.user_id IS NOT NEW.user_id) BEGIN
+            UPDATE leaderboard_monthly SET books = books - 1
+            WHERE month = substr(OLD.read_date, 1, 7) AND user_id = OLD.user_id;
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS books_monthly_update_new AFTER UPDATE OF read_date, user_id ON books
+        WHEN NEW.read_date GLOB '{READ_MONTH_GLOB}'
+         AND (OLD.read_date IS NOT NEW.read_date OR OLD.user_id IS NOT NEW.user_id) BEGIN
+            INSERT INTO leaderboard_monthly (month, user_id, books) VALUES (substr(NEW.read_date, 1, 7), NEW.user_id, 1)
+            ON CONFLICT(month, user_id) DO UPDATE SET books = books + 1;
+        END
+        """,
+        "INSERT INTO leaderboard_monthly (month, user_id, books) " + LEADERBOARD_MONTHLY_ACTUAL,
+    ]),
+    (7, "kanonik eser kataloğu (works)", _create_works),
+    (8, "keyset sayfalama indeksleri", [
+        # my_books: kullanıcının kitapları id sırasıyla, cursor'dan sonrası
+        "CREATE INDEX IF NOT EXISTS idx_books_user_id ON books(user_id, id)",
+    ]),
+    (9, "feed timeline (fan-out on write)", [
+        # Her okuyucunun feed'i: kendi kitapları + takip ettiklerinin kitapları
+        """
+        CREATE TABLE IF NOT EXISTS timeline (
+            user_id INTEGER NOT NULL,
+            book_id INTEGER NOT NULL,
+            author_id INTEGER NOT NULL,
+            created_at TEXT,
+            PRIMARY KEY(user_id, book_id),
+            FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_timeline_user_created ON timeline(user_id, created_at DESC, book_id DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_timeline_book ON timeline(book_id)",
+        "CREATE INDEX IF NOT EXISTS idx_timeline_user_author ON timeline(user_id, author_id)",
+        """
+        CREATE TRIGGER IF NOT EXISTS books_timeline_insert AFTER INSERT ON books BEGIN
+            INSERT OR IGNORE INTO timeline (user_id, book_id, author_id, created_at)
+            SELECT NEW.user_id, NEW.id, NEW.user_id, NEW.created_at
+            UNION ALL
+            SELECT follower_id, NEW.id, NEW.user_id, NEW.created_at FROM follows WHERE following_id = NEW.user_id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS books_timeline_delete AFTER DELETE ON books BEGIN
+            DELETE FROM timeline WHERE book_id = OLD.id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS books_timeline_update AFTER UPDATE OF user_id, created_at ON books
+        WHEN OLD.user_id IS NOT NEW.user_id OR OLD.created_at IS NOT NEW.created_at BEGIN
+            DELETE FROM timeline WHERE book_id = OLD.id;
+            INSERT OR IGNORE INTO timeline (user_id, book_id, author_id, created_at)
+            SELECT NEW.user_id, NEW.id, NEW.user_id, NEW.created_at
+            UNION ALL
+            SELECT follower_id, NEW.id, NEW.user_id, NEW.created_at FROM follows WHERE following_id = NEW.user_id;
+        END
+        """,
+        # Takip başlayınca takip edilenin son kitapları geriye dönük eklenir
+        f"""
+        CREATE TRIGGER IF NOT EXISTS follows_timeline_insert AFTER INSERT ON follows BEGIN
+            INSERT OR IGNORE INTO timeline (user_id, book_id, author_id, created_at)
+            SELECT NEW.follower_id, b.id, b.user_id, b.created_at FROM books b
+            WHERE b.user_id = NEW.following_id
+            ORDER BY b.created_at DESC LIMIT {TIMELINE_KEEP};
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS follows_timeline_delete AFTER DELETE ON follows
+        WHEN OLD.follower_id != OLD.following_id BEGIN
+            DELETE FROM timeline WHERE user_id = OLD.follower_id AND author_id = OLD.following_id;
+        END
+        """,
+        """
+        INSERT OR IGNORE INTO timeline (user_id, book_id, author_id, created_at)
+        SELECT b.user_id, b.id, b.user_id, b.created_at FROM books b
+        UNION ALL
+        SELECT f.follower_id, b.id, b.user_id, b.created_at
+        FROM follows f JOIN books b ON b.user_id = f.following_id
+        """,
+        f"""
+        DELETE FROM timeline WHERE rowid IN (
+            SELECT rowid FROM (
+                SELECT rowid, ROW_NUMBER() OVER (
+                    PARTITION BY user_id ORDER BY created_at DESC, book_id DESC
+                ) AS rn
+                FROM timeline
+            ) WHERE rn > {TIMELINE_KEEP}
+        )
+        """,
+    ]),
+    (10, "sohbet delta/geçmiş indeksleri", [
+        # get_private_messages: her yön için id aralığı (since_id / before_id)
+        "CREATE INDEX IF NOT EXISTS idx_private_messages_pair_id ON private_messages(sender_id, receiver_id, id)",
+    ]),
+    (11, "konuşma indeksi (conversations)", [
+        # Sıralı kullanıcı çifti başına tek satır (user_a < user_b; kendine mesajda eşit)
+        """
+        CREATE TABLE IF NOT EXISTS conversations (
+            user_a INTEGER NOT NULL,
+            user_b INTEGER NOT NULL,
+            last_message_id INTEGER NOT NULL,
+            last_activity TEXT,
+            unread_a INTEGER NOT NULL DEFAULT 0,
+            unread_b INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY(user_a, user_b),
+            CHECK(user_a <= user_b),
+            FOREIGN KEY(user_a) REFERENCES users(id) ON DELETE CASCADE,
+            FOREIGN KEY(user_b) REFERENCES users(id) ON DELETE CASCADE
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_conversations_a_activity ON conversations(user_a, last_activity DESC, user_b DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_conversations_b_activity ON conversations(user_b, last_activity DESC, user_a DESC)",
+        # Her mesajda son mesaj/aktivite güncellenir, alıcının okunmamış sayacı artar
+        """
+        CREATE TRIGGER IF NOT EXISTS private_messages_conversation AFTER INSERT ON private_messages BEGIN
+            INSERT INTO conversations (user_a, user_b, last_message_id, last_activity, unread_a, unread_b)
+            VALUES (
+                MIN(NEW.sender_id, NEW.receiver_id), MAX(NEW.sender_id, NEW.receiver_id),
+                NEW.id, NEW.created_at,
+                NEW.receiver_id < NEW.sender_id, NEW.receiver_id > NEW.sender_id
+            )
+            ON CONFLICT(user_a, user_b) DO UPDATE SET
+                last_message_id = excluded.last_message_id,
+                last_activity = excluded.last_activity,
+                unread_a = unread_a + excluded.unread_a,
+                unread_b = unread_b + excluded.unread_b
+            WHERE excluded.last_message_id > last_message_id;
+        END
+        """,
+        """
+        INSERT INTO conversations (user_a, user_b, last_message_id, last_activity)
+        SELECT c.user_a, c.user_b, c.last_id, pm.created_at
+        FROM (
+            SELECT MIN(sender_id, receiver_id) AS user_a, MAX(sender_id, receiver_id) AS user_b, MAX(id) AS last_id
+            FROM private_messages
+            GROUP BY 1, 2
+        ) c
+        JOIN private_messages pm ON pm.id = c.last_id
+        """,
+    ]),
+    (12, "tam metin arama (FTS5)", _create_fts),
+    (13, "kullanıcı adı trigram dizini", [
+        # Alt dize araması: FTS5 trigram (büyük/küçük harf duyarsız), 3+ karakterlik sorgular için
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS users_trgm USING fts5(
+            username, content='users', content_rowid='id', tokenize='trigram case_sensitive 0'
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS users_trgm_insert AFTER INSERT ON users BEGIN
+            INSERT INTO users_trgm (rowid, username) VALUES (NEW.id, NEW.username);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS users_trgm_delete AFTER DELETE ON users BEGIN
+            INSERT INTO users_trgm (users_trgm, rowid, username) VALUES ('delete', OLD.id, OLD.username);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS users_trgm_update AFTER UPDATE OF username ON users BEGIN
+            INSERT INTO users_trgm (users_trgm, rowid, username) VALUES ('delete', OLD.id, OLD.username);
+            INSERT INTO users_trgm (rowid, username) VALUES (NEW.id, NEW.username);
+        END
+        """,
+        "INSERT INTO users_trgm (users_trgm) VALUES ('rebuild')",
+        # Önek araması ve önek öncelikli sıralama için
+        "CREATE INDEX IF NOT EXISTS idx_users_username_nocase ON users(username COLLATE NOCASE)",
+    ]),
+    (14, "parça önbelleği veri sürümleri", _create_data_versions),
+    (15, "başarım iş kuyruğu (achievement_jobs)", [
+        # Kullanıcı başına olay tekildir; aynı olay tekrar gelince mevcut işle birleşir
+        """
+        CREATE TABLE IF NOT EXISTS achievement_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            event TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (user_id, event)
+        )
+        """,
+    ]),
+    (16, "başarım kuyruğu başı indeksi", [
+        # Sıradaki iş: denenebilir işler id sırasıyla; kısmi indeks sorgudaki sabit koşulla eşleşir
+        f"""
+        CREATE INDEX IF NOT EXISTS idx_achievement_jobs_ready ON achievement_jobs(id)
+        WHERE attempts < {JOB_MAX_ATTEMPTS}
+        """,
+    ]),
+    # "İlk satır mı?" kontrolleri COUNT(*) = 1 yerine NOT EXISTS ile: COUNT kullanıcının o yazardaki
+    # tüm kitaplarını sayıyordu, toplu içe aktarmada ekleme maliyeti kütüphaneyle büyüyordu
+    (17, "sayaç tetikleyicilerinde ilk satır kontrolü", [
+        "DROP TRIGGER IF EXISTS books_stats_insert",
+        """
+        CREATE TRIGGER books_stats_insert AFTER INSERT ON books BEGIN
+            INSERT OR IGNORE INTO user_stats (user_id) VALUES (NEW.user_id);
+            UPDATE user_stats
+            SET book_count = book_count + 1,
+                page_total = page_total + COALESCE(NEW.page, 0),
+                distinct_authors = distinct_authors
+                    + NOT EXISTS (SELECT 1 FROM books WHERE user_id = NEW.user_id AND author = NEW.author AND id != NEW.id)
+            WHERE user_id = NEW.user_id;
+        END
+        """,
+        "DROP TRIGGER IF EXISTS books_stats_update_author",
+        """
+        CREATE TRIGGER books_stats_update_author AFTER UPDATE OF author, user_id ON books
+        WHEN OLD.author IS NOT NEW.author OR OLD.user_id IS NOT NEW.user_id BEGIN
+            INSERT OR IGNORE INTO user_stats (user_id) VALUES (NEW.user_id);
+            UPDATE user_stats
+            SET distinct_authors = distinct_authors
+                - NOT EXISTS (SELECT 1 FROM books WHERE user_id = OLD.user_id AND author = OLD.author)
+            WHERE user_id = OLD.user_id;
+            UPDATE user_stats
+            SET distinct_authors = distinct_authors
+                + NOT EXISTS (SELECT 1 FROM books WHERE user_id = NEW.user_id AND author = NEW.author AND id != NEW.id)
+            WHERE user_id = NEW.user_id;
+        END
+        """,
+        "DROP TRIGGER IF EXISTS notes_stats_insert",
+        """
+        CREATE TRIGGER notes_stats_insert AFTER INSERT ON notes BEGIN
+            INSERT OR IGNORE INTO user_stats (user_id) VALUES (NEW.user_id);
+            UPDATE user_stats
+            SET notes_count = notes_count
+                + NOT EXISTS (SELECT 1 FROM notes WHERE book_id = NEW.book_id AND user_id = NEW.user_id AND id != NEW.id)
+            WHERE user_id = NEW.user_id;
+        END
+        """,
+        "DROP TRIGGER IF EXISTS books_works_insert",
+        """
+        CREATE TRIGGER books_works_insert AFTER INSERT ON books
+        WHEN NEW.work_id IS NOT NULL BEGIN
+            UPDATE works
+            SET reader_count = reader_count
+                + NOT EXISTS (SELECT 1 FROM books WHERE work_id = NEW.work_id AND user_id = NEW.user_id AND id != NEW.id)
+            WHERE id = NEW.work_id;
+        END
+        """,
+        "DROP TRIGGER IF EXISTS books_works_update",
+        """
+        CREATE TRIGGER books_works_update AFTER UPDATE OF work_id, user_id ON books
+        WHEN OLD.work_id IS NOT NEW.work_id OR OLD.user_id IS NOT NEW.user_id BEGIN
+            UPDATE works
+            SET reader_count = reader_count
+                - NOT EXISTS (SELECT 1 FROM books WHERE work_id = OLD.work_id AND user_id = OLD.user_id)
+            WHERE id = OLD.work_id;
+            DELETE FROM works WHERE id = OLD.work_id AND reader_count <= 0;
+            UPDATE works
+            SET reader_count = reader_count
+                + NOT EXISTS (SELECT 1 FROM books WHERE work_id = NEW.work_id AND user_id = NEW.user_id AND id != NEW.id)
+            WHERE id = NEW.work_id;
+        END
+        """,
+    ]),
+    (18, "yönetici bayrağı (users.is_admin)", [
+        "ALTER TABLE users ADD COLUMN is_admin INTEGER NOT NULL DEFAULT 0",
+    ]),
+    (19, "profil duvarı yorumları için NULL book_id", _nullable_comment_book),
+]
+
+
+def current_version(conn):
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def migrate(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.commit()
+
+    applied = current_version(conn)
+    for version, name, step in MIGRATIONS:
+        if version <= applied:
+            continue
+        conn.execute("BEGIN")
+        try:
+            if callable(step):
+                step(conn)
+            else:
+                for sql in step:
+                    conn.execute(sql)
+            conn.execute("INSERT INTO schema_version (version, name) VALUES (?, ?)", (version, name))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f"✅ Migrasyon {version} uygulandı: {name}")
+
+
+# ------------------ Sorgu planı kontrolü ------------------
+# Route'ların sıcak sorguları; hiçbiri indekssiz tam tablo taraması yapmamalı.
+# Route'taki SQL değişince buradaki karşılığı da güncellenir (IN listeleri üç elemanla temsil edilir).
+HOT_QUERIES = {
+    "user_stats.row": "SELECT book_count, page_total, followers, following FROM user_stats WHERE user_id=?",
+    "dashboard.last_read": "SELECT title FROM books WHERE user_id=? AND read_date IS NOT NULL ORDER BY read_date DESC LIMIT 1",
+    "dashboard.weekly": "SELECT COUNT(*) FROM books WHERE user_id=? AND read_date>=?",
+    "add_book.duplicate": "SELECT id FROM books WHERE title=? AND author=? AND user_id=?",
+    "my_books.page": "SELECT id, title FROM books WHERE user_id=? AND id > ? ORDER BY id LIMIT 31",
+    "my_books.notes": "SELECT book_id, note FROM notes WHERE user_id=? AND book_id IN (?, ?, ?) ORDER BY id",
+    "my_books.top_author": "SELECT author FROM books WHERE user_id=? GROUP BY author ORDER BY COUNT(*) DESC LIMIT 1",
+    "achievements.unlocked": "SELECT achievement_id FROM user_achievements WHERE user_id=?",
+    "achievements.pending": "SELECT 1 FROM achievement_jobs WHERE user_id=? AND attempts < ? LIMIT 1",
+    "achievements.weekly_pages": "SELECT SUM(page) FROM books WHERE user_id=? AND created_at >= date('now', ?)",
+    "achievements.common_books": """
+        SELECT COUNT(*) FROM books b1
+        JOIN books b2 ON b1.title = b2.title AND b1.user_id != b2.user_id
+        WHERE b1.user_id=?
+    """,
+    "inbox.side_a": """
+        SELECT user_b FROM conversations WHERE user_a = ? AND (last_activity, user_b) < (?, ?)
+        ORDER BY last_activity DESC, user_b DESC LIMIT 21
+    """,
+    "inbox.side_b": """
+        SELECT user_a FROM conversations WHERE user_b = ? AND (last_activity, user_a) < (?, ?)
+        ORDER BY last_activity DESC, user_a DESC LIMIT 21
+    """,
+    "chat.general_since": """
+        SELECT gc.id, u.username FROM general_chat gc
+        JOIN users u ON gc.user_id = u.id WHERE gc.id > ? ORDER BY gc.id LIMIT 50
+    """,
+    "chat.general_before": """
+        SELECT gc.id, u.username FROM general_chat gc
+        JOIN users u ON gc.user_id = u.id WHERE gc.id < ? ORDER BY gc.id DESC LIMIT 50
+    """,
+    "chat.private_since": """
+        SELECT id FROM private_messages WHERE sender_id=? AND receiver_id=? AND id > ?
+        ORDER BY id LIMIT 50
+    """,
+    "chat.private_before": """
+        SELECT id FROM private_messages WHERE sender_id=? AND receiver_id=? AND id < ?
+        ORDER BY id DESC LIMIT 50
+    """,
+    "chat.private_latest": "SELECT MAX(id) FROM private_messages WHERE sender_id=? AND receiver_id=?",
+    "jobs.next": f"SELECT user_id FROM achievement_jobs WHERE attempts < {JOB_MAX_ATTEMPTS} ORDER BY id LIMIT 1",
+    "jobs.user": f"SELECT id, event FROM achievement_jobs WHERE user_id=? AND attempts < {JOB_MAX_ATTEMPTS}",
+    "social.users": "SELECT id, username FROM users WHERE username > ? ORDER BY username LIMIT 31",
+    "followers.list": """
+        SELECT u.id, u.username FROM follows f JOIN users u ON f.follower_id = u.id
+        WHERE f.following_id=? AND f.follower_id > ? ORDER BY f.follower_id LIMIT 31
+    """,
+    "following.list": """
+        SELECT u.id, u.username FROM follows f JOIN users u ON f.following_id = u.id
+        WHERE f.follower_id=? AND f.following_id > ? ORDER BY f.following_id LIMIT 31
+    """,
+    "bookdetails.work": "SELECT id, title, author, page FROM works WHERE title_key=? AND author_key=?",
+    "bookdetails.notes": """
+        SELECT n.note, u.username FROM books b
+        JOIN notes n ON b.id = n.book_id LEFT JOIN users u ON n.user_id = u.id
+        WHERE b.work_id=? ORDER BY n.id DESC
+    """,
+    "profile.books": "SELECT b.id, b.title FROM books b WHERE b.user_id=? ORDER BY b.title ASC",
+    "profile.common_books": """
+        SELECT b1.id, b1.title FROM books b1
+        JOIN books b2 ON b1.title = b2.title AND b2.user_id = ?
+        WHERE b1.user_id = ?
+    """,
+    "profile.wall": """
+        SELECT c.comment, u.username, c.created_at FROM comments c JOIN users u ON u.id = c.user_id
+        WHERE c.book_id IS NULL ORDER BY c.created_at ASC
+    """,
+    "feed.timeline": """
+        SELECT b.id, u.username FROM timeline t
+        JOIN books b ON b.id = t.book_id JOIN users u ON u.id = t.author_id
+        WHERE t.user_id = ? ORDER BY t.created_at DESC, t.book_id DESC LIMIT 30
+    """,
+    "users.prefix": """
+        SELECT id, username FROM users
+        WHERE username COLLATE NOCASE >= ? AND username COLLATE NOCASE < ?
+        ORDER BY username COLLATE NOCASE LIMIT 10
+    """,
+    "cache.versions": "SELECT name, version FROM data_versions WHERE name IN (?, ?)",
+    "users.trigram": "SELECT rowid FROM users_trgm WHERE users_trgm MATCH ? LIMIT 50",
+    "search.books": """
+        SELECT b.id, u.username FROM books_fts JOIN books b ON b.id = books_fts.rowid
+        JOIN users u ON u.id = b.user_id WHERE books_fts MATCH ? ORDER BY bm25(books_fts) LIMIT 21
+    """,
+    "search.notes": """
+        SELECT n.id, b.title FROM notes_fts JOIN notes n ON n.id = notes_fts.rowid
+        JOIN books b ON b.id = n.book_id WHERE notes_fts MATCH ? ORDER BY bm25(notes_fts) LIMIT 21
+    """,
+    "feed.before": """
+        SELECT t.book_id FROM timeline t
+        WHERE t.user_id = ? AND (t.created_at, t.book_id) < (?, ?)
+        ORDER BY t.created_at DESC, t.book_id DESC LIMIT 31
+    """,
+    "feed.comments": """
+        SELECT c.book_id, c.comment, u.username,
+               ROW_NUMBER() OVER (PARTITION BY c.book_id ORDER BY c.created_at, c.id)
+        FROM comments c JOIN users u ON c.user_id = u.id
+        WHERE c.book_id IN (?, ?, ?)
+    """,
+    "feed.trim": """
+        DELETE FROM timeline WHERE user_id = ? AND (created_at, book_id) < (
+            SELECT created_at, book_id FROM timeline WHERE user_id = ?
+            ORDER BY created_at DESC, book_id DESC LIMIT 1 OFFSET 499
+        )
+    """,
+    "leaderboard.books": "SELECT user_id, book_count FROM user_stats ORDER BY book_count DESC LIMIT 10",
+    "leaderboard.pages": "SELECT user_id, page_total FROM user_stats ORDER BY page_total DESC LIMIT 10",
+    "leaderboard.month": "SELECT user_id, books FROM leaderboard_monthly WHERE month = ? ORDER BY books DESC LIMIT 10",
+    "leaderboard.xp": "SELECT username, xp FROM users ORDER BY xp DESC LIMIT 10",
+    "library.works": "SELECT id, title, author, page FROM works WHERE (title, id) > (?, ?) ORDER BY title, id LIMIT 61",
+    "library.readers": """
+        SELECT b.work_id, u.username FROM books b JOIN users u ON b.user_id = u.id
+        WHERE b.work_id IN (?, ?, ?) GROUP BY b.work_id, u.id ORDER BY MIN(b.id)
+    """,
+}
+
+_FULL_SCAN = re.compile(r"^SCAN (\w+)$")
+
+
+def verify_query_plans(conn, queries=None):
+    problems = []
+    for name, sql in (queries or HOT_QUERIES).items():
+        params = (None,) * sql.count("?")
+        for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params):
+            detail = row[-1]
+            if _FULL_SCAN.match(detail):
+                problems.append((name, detail))
+    return problems
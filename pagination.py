@@ -0,0 +1,57 @@
+import base64
+import json
+
+from flask import request
+
+# ------------------ Keyset sayfalama ------------------
+# OFFSET yerine son satırın sıralama anahtarı (cursor) taşınır; her sayfa
+# indeks üzerinde "anahtardan sonrası" araması olur, maliyet sayfa boyutuyla sınırlı kalır.
+DEFAULT_PAGE_SIZE = 30
+MAX_PAGE_SIZE = 100
+
+
+# Sıralama anahtarını URL'de taşınabilir opak bir dizeye çevirir
+def encode_cursor(*values):
+    raw = json.dumps(values, separators=(",", ":"), ensure_ascii=False)
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+# Cursor değerleri doğrudan SQL parametresi olur; yalnızca bağlanabilir sabit türler kabul edilir
+# (NULL olabilen sıralama sütunları için None da)
+CURSOR_VALUE_TYPES = (int, float, str, type(None))
+
+
+# Bozuk, beklenen uzunlukta olmayan ya da sabit olmayan değer (liste, nesne) içeren cursor
+# ilk sayfa (None) sayılır
+def decode_cursor(token, length):
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        values = json.loads(raw.decode("utf-8"))
+    except (ValueError, UnicodeDecodeError):
+        return None
+    if not isinstance(values, list) or len(values) != length:
+        return None
+    if not all(isinstance(value, CURSOR_VALUE_TYPES) for value in values):
+        return None
+    return values
+
+
+# İstekteki cursor/size parametrelerini okur
+def page_args(key_length, default_size=DEFAULT_PAGE_SIZE):
+    size = request.args.get("size", default_size, type=int)
+    size = min(max(size, 1), MAX_PAGE_SIZE)
+    return decode_cursor(request.args.get("cursor"), key_length), size
+
+
+# size+1 satır çekilmiş sonuçtan sayfayı ve bir sonraki cursor'u ayırır
+def split_page(rows, size, key):
+    if len(rows) <= size:
+        return rows, None
+    rows = rows[:size]
+    return rows, encode_cursor(*key(rows[-1]))
+
+
+def wants_json():
+    return request.args.get("format") == "json"
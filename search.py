@@ -0,0 +1,169 @@
+import re
+
+from markupsafe import Markup, escape
+
+# ------------------ Tam metin arama ------------------
+# books_fts / notes_fts / comments_fts (FTS5, migrasyon 12) üzerinde bm25 sıralı arama.
+# Snippet işaretleri kontrol karakterleriyle alınır, metin kaçışlandıktan sonra <mark>'a çevrilir.
+SEARCH_PAGE_SIZE = 20
+SNIPPET_TOKENS = 12
+_MARK_OPEN, _MARK_CLOSE = "\x02", "\x03"
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+SEARCH_KINDS = ("books", "notes", "comments")
+
+
+# Kullanıcı girdisini güvenli bir MATCH ifadesine çevirir: her kelime tırnaklı,
+# son kelime önek araması (yazarken arama için). Kelime yoksa None.
+def fts_query(q):
+    tokens = _TOKEN.findall(q or "")
+    if not tokens:
+        return None
+    terms = [f'"{t}"' for t in tokens]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+def highlight(snippet):
+    if snippet is None:
+        return Markup("")
+    text = str(escape(snippet))
+    return Markup(text.replace(_MARK_OPEN, "<mark>").replace(_MARK_CLOSE, "</mark>"))
+
+
+def _snippet(fts, column):
+    return f"snippet({fts}, {column}, '{_MARK_OPEN}', '{_MARK_CLOSE}', '…', {SNIPPET_TOKENS})"
+
+
+def search_books(conn, match, limit, offset=0):
+    cursor = conn.execute(f"""
+        SELECT b.id, b.title, b.author, u.username,
+               {_snippet('books_fts', 0)}, {_snippet('books_fts', 1)}
+        FROM books_fts
+        JOIN books b ON b.id = books_fts.rowid
+        JOIN users u ON u.id = b.user_id
+        WHERE books_fts MATCH ?
+        ORDER BY bm25(books_fts), b.id
+        LIMIT ? OFFSET ?
+    """, (match, limit, offset))
+    return [{
+        "book_id": r[0],
+        "title": r[1],
+        "author": r[2],
+        "username": r[3],
+        "title_snippet": highlight(r[4]),
+        "author_snippet": highlight(r[5])
+    } for r in cursor.fetchall()]
+
+
+def search_notes(conn, match, limit, offset=0):
+    cursor = conn.execute(f"""
+        SELECT n.id, b.id, b.title, b.author, u.username, {_snippet('notes_fts', 0)}
+        FROM notes_fts
+        JOIN notes n ON n.id = notes_fts.rowid
+        JOIN books b ON b.id = n.book_id
+        LEFT JOIN users u ON u.id = n.user_id
+        WHERE notes_fts MATCH ?
+        ORDER BY bm25(notes_fts), n.id
+        LIMIT ? OFFSET ?
+    """, (match, limit, offset))
+    return [{
+        "note_id": r[0],
+        "book_id": r[1],
+        "title": r[2],
+        "author": r[3],
+        "username": r[4],
+        "snippet": highlight(r[5])
+    } for r in cursor.fetchall()]
+
+
+# Profil duvarı yorumları (book_id NULL) bir kitaba bağlı olmadığı için sonuçlara girmez
+def search_comments(conn, match, limit, offset=0):
+    cursor = conn.execute(f"""
+        SELECT c.id, b.id, b.title, b.author, u.username, {_snippet('comments_fts', 0)}
+        FROM comments_fts
+        JOIN comments c ON c.id = comments_fts.rowid
+        JOIN books b ON b.id = c.book_id
+        JOIN users u ON u.id = c.user_id
+        WHERE comments_fts MATCH ?
+        ORDER BY bm25(comments_fts), c.id
+        LIMIT ? OFFSET ?
+    """, (match, limit, offset))
+    return [{
+        "comment_id": r[0],
+        "book_id": r[1],
+        "title": r[2],
+        "author": r[3],
+        "username": r[4],
+        "snippet": highlight(r[5])
+    } for r in cursor.fetchall()]
+
+
+SEARCHERS = {
+    "books": search_books,
+    "notes": search_notes,
+    "comments": search_comments,
+}
+
+
+# Her tür için bir sayfa; bir fazlası çekilerek sonraki sayfa olup olmadığı anlaşılır
+def search_all(conn, q, kinds=SEARCH_KINDS, page=1, size=SEARCH_PAGE_SIZE):
+    match = fts_query(q)
+    results = {}
+    has_more = {}
+    for kind in kinds:
+        if match is None:
+            results[kind], has_more[kind] = [], False
+            continue
+        rows = SEARCHERS[kind](conn, match, size + 1, (page - 1) * size)
+        results[kind], has_more[kind] = rows[:size], len(rows) > size
+    return results, has_more
+
+
+# ------------------ Kullanıcı arama ------------------
+# 3+ karakterde users_trgm (FTS5 trigram) alt dize eşleşmesi, daha kısa sorgularda
+# NOCASE indeksinde önek aralığı kullanılır; LIKE '%q%' ile tablo taranmaz.
+USER_SEARCH_LIMIT = 10
+TRIGRAM_MIN = 3
+_PREFIX_END = "\U0010ffff"
+
+
+def trigram_query(q):
+    return '"' + q.replace('"', '""') + '"'
+
+
+# users tablosu için WHERE parçası ve parametreleri (social() sayfalamasıyla birlikte kullanılır)
+def user_match_clause(q):
+    if len(q) >= TRIGRAM_MIN:
+        return "id IN (SELECT rowid FROM users_trgm WHERE users_trgm MATCH ?)", [trigram_query(q)]
+    return "username COLLATE NOCASE >= ? AND username COLLATE NOCASE < ?", [q, q + _PREFIX_END]
+
+
+# Yazarken arama: önce adı q ile başlayanlar, sonra adında q geçenler (kısa adlar önce)
+def search_users(conn, q, limit=USER_SEARCH_LIMIT):
+    q = (q or "").strip()
+    if not q:
+        return []
+
+    rows = conn.execute("""
+        SELECT id, username FROM users
+        WHERE username COLLATE NOCASE >= ? AND username COLLATE NOCASE < ?
+        ORDER BY username COLLATE NOCASE LIMIT ?
+    """, (q, q + _PREFIX_END, limit)).fetchall()
+
+    if len(rows) < limit and len(q) >= TRIGRAM_MIN:
+        seen = {r[0] for r in rows}
+        for row in conn.execute("""
+            SELECT u.id, u.username
+            FROM users_trgm
+            JOIN users u ON u.id = users_trgm.rowid
+            WHERE users_trgm MATCH ?
+            ORDER BY length(u.username), u.username
+            LIMIT ?
+        """, (trigram_query(q), limit + len(rows))):
+            if row[0] not in seen:
+                rows.append(row)
+                if len(rows) >= limit:
+                    break
+
+    return [{"id": r[0], "username": r[1]} for r in rows]